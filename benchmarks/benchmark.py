@@ -0,0 +1,128 @@
+'''
+Benchmarks of Spyrk against the local fake Spark Cloud: device discovery
+time, variable and function call throughput, and latency percentiles.
+
+    $ python benchmarks/benchmark.py --devices 200 --latency 0.02 --offline 2
+
+No network access is needed: every request goes to a FakeCloud started on
+localhost, whose per-device latency, offline devices and error rate are set
+from the command line.
+'''
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hammock import Hammock
+
+from spyrk import SparkCloud, PooledSession
+from spyrk.fake_cloud import FakeCloud
+from spyrk.instrumentation import Instrument, clock
+
+class LatencyRecorder(Instrument):
+
+    """Keeps the duration of every request, per endpoint."""
+
+    def __init__(self):
+        self.durations = {}
+
+    def after_request(self, endpoint, device_id, status, duration, error):
+        self.durations.setdefault(endpoint, []).append(duration)
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+def report(name, elapsed, count=None, durations=None):
+    line = '{:<40} {:>9.3f} s'.format(name, elapsed)
+    if count:
+        line += ' {:>10.1f} ops/s'.format(count / elapsed)
+    if durations:
+        line += '   p50 {:.1f} ms  p95 {:.1f} ms  p99 {:.1f} ms'.format(
+            *[percentile(durations, p) * 1000 for p in (50, 95, 99)]
+        )
+    print(line)
+
+def new_spark(cloud, args, recorder=None, **kwargs):
+    session = PooledSession(pool_maxsize=max(args.workers, 10))
+    return SparkCloud(
+        cloud.access_token, spark_api=Hammock(cloud.url), session=session,
+        timeout=args.timeout, instruments=[recorder] if recorder else None, **kwargs
+    )
+
+def bench_discovery(cloud, args):
+    for name, kwargs in (
+        ('discovery (lazy)', {}),
+        ('discovery (eager, sequential)', {'eager': True}),
+        ('discovery (eager, {} workers)'.format(args.workers), {'eager': True, 'max_workers': args.workers}),
+    ):
+        if 'sequential' in name and args.skip_sequential:
+            continue
+        spark = new_spark(cloud, args, **kwargs)
+        start = clock()
+        try:
+            spark.devices
+        except Exception as e:
+            print('{:<40} failed after {:.3f} s: {}'.format(name, clock() - start, e))
+        else:
+            report(name, clock() - start)
+
+def bench_variables(cloud, args):
+    recorder = LatencyRecorder()
+    spark = new_spark(cloud, args, recorder, max_workers=args.workers)
+    spark.read_variables(['temperature'])  # fetch the device details
+    recorder.durations.clear()
+    start = clock()
+    for _ in range(args.rounds):
+        results = spark.read_variables(['temperature', 'state'])
+    report(
+        'read_variables ({} workers)'.format(args.workers), clock() - start,
+        len(results) * args.rounds, recorder.durations.get('variable')
+    )
+
+def bench_functions(cloud, args):
+    recorder = LatencyRecorder()
+    spark = new_spark(cloud, args, recorder)
+    devices = [d for d in spark.devices.values() if d.connected and d.id not in cloud.offline_ids]
+    devices = devices[:args.calls]
+    for device in devices:
+        device.functions
+    recorder.durations.clear()
+    start = clock()
+    for device in devices:
+        try:
+            device.digitalwrite('D7', 'HIGH')
+        except Exception:
+            pass
+    report('function calls (sequential)', clock() - start, len(devices), recorder.durations.get('function'))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=100, help='devices of the fake account')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per device request')
+    parser.add_argument('--offline', type=int, default=0, help='devices which never answer')
+    parser.add_argument('--offline-timeout', type=float, default=1.0, help='seconds before an offline device request fails')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a device request failing')
+    parser.add_argument('--workers', type=int, default=16, help='threads for concurrent operations')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds of fleet-wide variable reads')
+    parser.add_argument('--calls', type=int, default=50, help='function calls to time')
+    parser.add_argument('--timeout', type=float, default=30, help='SparkCloud timeout')
+    parser.add_argument('--skip-sequential', action='store_true', help='skip the sequential eager discovery')
+    args = parser.parse_args(argv)
+
+    with FakeCloud(
+        devices=args.devices, latency=args.latency, offline=args.offline,
+        offline_timeout=args.offline_timeout, error_rate=args.error_rate
+    ) as cloud:
+        print('{} devices, {:.0f} ms latency, {} offline, {:.0%} errors'.format(
+            args.devices, args.latency * 1000, args.offline, args.error_rate
+        ))
+        bench_discovery(cloud, args)
+        bench_variables(cloud, args)
+        bench_functions(cloud, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Memory benchmark of the devices catalog of a large fleet: the memory kept by
+SparkCloud once every device is listed with its functions and variables.
+
+    $ python benchmarks/memory.py --devices 20000 --firmwares 5
+
+The devices come from a local FakeCloud, devices running the same firmware
+exposing the same functions and variables. Their details are loaded from a
+catalog snapshot to measure the catalog rather than 10k HTTP requests.
+'''
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hammock import Hammock
+
+from spyrk import SparkCloud, CatalogSnapshot
+from spyrk import fake_cloud
+from spyrk.fake_cloud import FakeCloud
+from spyrk.instrumentation import clock
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10000, help='devices of the fake account')
+    parser.add_argument('--firmwares', type=int, default=3, help='distinct sets of functions and variables')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'devices.json')
+    try:
+        with FakeCloud(devices=args.devices) as cloud:
+            entries = []
+            for i, listing in enumerate(cloud.devices):
+                status, info = cloud.handle('GET', '/v1/devices/' + listing['id'], {'access_token': cloud.access_token})
+                info['variables'] = dict(
+                    ('{}{}'.format(name, i % args.firmwares), kind) for name, kind in fake_cloud.VARIABLES.items()
+                )
+                entries.append((listing, info))
+            CatalogSnapshot(path).save(entries)
+            del entries
+
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            start = clock()
+            spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url), snapshot=path, eager=True)
+            devices = spark.devices
+            elapsed = clock() - start
+            spark._revalidation.join()
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory)
+
+    print('{} devices, {} firmwares, loaded in {:.2f} s'.format(len(devices), args.firmwares, elapsed))
+    print('catalog memory: {:.1f} MiB, {:.0f} bytes per device'.format(
+        retained / 2.0 ** 20, retained / float(len(devices))
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -95,9 +95,14 @@ setup(
     install_requires=[
         'hammock',
         'cached-property',
-        'mock'
+        'mock',
+        'futures; python_version < "3"',
     ],
     
+    extras_require={
+        'async': ['aiohttp'],
+    },
+    
     tests_require = ['pytest'],
     cmdclass = { 'test': PyTest },
 )
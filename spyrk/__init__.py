@@ -17,13 +17,38 @@
 
 * SparkCloud class provides access to the Spark Cloud.
   >>> from spyrk import SparkCloud
+* PooledSession class is the keep-alive HTTP session shared by SparkCloud
+  objects, with configurable pool size and proxies.
+  >>> from spyrk import PooledSession
+* AsyncSparkCloud class provides asyncio access to the Spark Cloud (Python 3,
+  requires aiohttp).
+  >>> from spyrk import AsyncSparkCloud
 
 Spyrk is licensed under LGPLv3.
 
 http://github.com/Alidron/spyrk
 """
 
-from .spark_cloud import SparkCloud
+from .spark_cloud import SparkCloud, VariableResult, FunctionResult
+from .session import PooledSession
+from .events import Event, EventStream
+from .cache import VariableCache
+from .catalog import CatalogSnapshot, SharedCatalog
+from .tokens import TokenStore, FileTokenStore
+from .instrumentation import Instrument, MetricsCollector
+from .errors import (
+    SparkCloudError, AuthenticationError, DeviceTimeoutError,
+    DeviceOfflineError, CircuitOpenError,
+)
+from .resilience import RetryPolicy, CircuitBreaker
+from .timeouts import AdaptiveTimeout
+from .sampler import Sampler, RingBuffer
+from .publisher import EventPublisher
+from .scheduler import RequestScheduler, priority, CONTROL, INTERACTIVE, BACKGROUND
+try:
+    from .async_cloud import AsyncSparkCloud
+except SyntaxError:  # Python 2
+    AsyncSparkCloud = None
 from .__about__ import (
     __title__, __summary__, __uri__, __version__,
     __author__, __email__, __license__, __copyright__,
@@ -31,6 +56,35 @@ from .__about__ import (
 
 __all__ = [
     'SparkCloud',
+    'VariableResult',
+    'FunctionResult',
+    'PooledSession',
+    'Event',
+    'EventStream',
+    'VariableCache',
+    'CatalogSnapshot',
+    'SharedCatalog',
+    'TokenStore',
+    'FileTokenStore',
+    'Instrument',
+    'MetricsCollector',
+    'SparkCloudError',
+    'AuthenticationError',
+    'DeviceTimeoutError',
+    'DeviceOfflineError',
+    'CircuitOpenError',
+    'RetryPolicy',
+    'CircuitBreaker',
+    'AdaptiveTimeout',
+    'RequestScheduler',
+    'Sampler',
+    'RingBuffer',
+    'EventPublisher',
+    'priority',
+    'CONTROL',
+    'INTERACTIVE',
+    'BACKGROUND',
+    'AsyncSparkCloud',
     
     '__title__', '__summary__', '__uri__', '__version__',
     '__author__', '__email__', '__license__', '__copyright__',
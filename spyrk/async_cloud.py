@@ -0,0 +1,471 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import base64
+import time
+
+try:
+    import aiohttp  # pip install aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import instrumentation
+from .errors import error_from_reply, SparkCloudError
+from .events import SSEParser, READ_TIMEOUT, to_event, _is_transient
+from .resilience import RetryPolicy, device_timeout_error
+from .timeouts import operation_timeout, split_timeout
+from .spark_cloud import _DeviceCatalog, _BaseDevice, VariableResult, FunctionResult, _exposes_function
+
+API_URL = 'https://api.particle.io'
+
+NETWORK_ERRORS = (IOError, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp else ())
+
+async def _acquire(scheduler, endpoint):
+    """Waits for the turn of a request to endpoint in a RequestScheduler
+    without blocking the event loop."""
+    ticket = scheduler.enqueue(endpoint)
+    try:
+        while True:
+            delay = scheduler.try_acquire(ticket)
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+    except BaseException:
+        scheduler.cancel(ticket)
+        raise
+
+class AsyncSparkCloud(_DeviceCatalog):
+
+    """Provides asyncio access to the Spark Cloud.
+
+    >>> spark = await AsyncSparkCloud.login(USERNAME, PASSWORD)
+    # Or
+    >>> spark = AsyncSparkCloud(ACCESS_TOKEN)
+
+    # List devices (also required once before the shortcut form below)
+    >>> print(await spark.devices())
+
+    # Access device
+    >>> spark.captain_hamster
+
+    # Call a function
+    >>> await spark.captain_hamster.digitalwrite('D7', 'HIGH')
+
+    # Get variable value
+    >>> await spark.captain_hamster.myvariable
+
+    # Release the HTTP connections
+    >>> await spark.close()
+    """
+
+    def __init__(self, access_token, api_url=API_URL, session=None, timeout=30, max_concurrency=100, ttl=10, instruments=None,
+                 retry=None, circuit_breaker=None, timeouts=None, adaptive_timeout=None, scheduler=None):
+        """Initialise the connection to a Spark Cloud.
+
+        session can be an aiohttp.ClientSession to use, otherwise one is
+        created on the first request and closed by close().
+
+        At most max_concurrency requests are sent at the same time, the others
+        wait for their turn, so thousands of device operations can be awaited
+        at once. The devices listing is cached for ttl seconds.
+
+        instruments is a list of Instrument whose hooks are called around each
+        request, and retry, circuit_breaker, timeout, timeouts,
+        adaptive_timeout and scheduler work like for SparkCloud. A scheduler
+        can be shared with SparkCloud objects.
+        """
+        if session is None and aiohttp is None:
+            raise ImportError("AsyncSparkCloud requires aiohttp: pip install aiohttp")
+        self.access_token = access_token
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.ttl = ttl
+        self.instruments = list(instruments or [])
+        self.timeouts = dict(timeouts or {})
+        self.adaptive_timeout = adaptive_timeout
+        if adaptive_timeout is not None and adaptive_timeout not in self.instruments:
+            self.instruments.append(adaptive_timeout)
+        if retry is not None and not isinstance(retry, RetryPolicy):
+            retry = RetryPolicy(retries=retry)
+        self.retry = retry
+        self.circuit_breaker = circuit_breaker
+        self.scheduler = scheduler
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+        self._devices_lock = None
+        self._devices = None
+        self._devices_time = 0
+        self._flights = {}
+        self._init_catalog()
+
+    @classmethod
+    async def login(cls, username, password, **kwargs):
+        """Proceed to login to the Spark Cloud and returns an AsyncSparkCloud
+        using the new access token."""
+        spark = cls(None, **kwargs)
+        data = {
+            'username': username,
+            'password': password,
+            'grant_type': 'password'
+        }
+        json = await spark._request(instrumentation.LOGIN, None, 'POST', '/oauth/token', data=data, auth=('spark', 'spark'))
+        spark.access_token = json['access_token']
+        return spark
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the HTTP session if it was created by this object."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+        return self._session
+
+    @staticmethod
+    def _check_error(status, json, device_id=None):
+        """Raises a SparkCloudError if the Spark Cloud returned an error."""
+        if status != 200:
+            raise error_from_reply(status, json, device_id)
+
+    @staticmethod
+    async def _error_json(r):
+        """Returns the decoded JSON of an error reply, or None."""
+        try:
+            return await r.json()
+        except (ValueError, aiohttp.ContentTypeError if aiohttp else ValueError):
+            return None
+
+    async def _request(self, endpoint, device_id, method, path, **kwargs):
+        """Sends a request to the Spark Cloud and returns the decoded JSON
+        reply.
+
+        endpoint and device_id tell the instruments what the request is for.
+        Transient errors are retried according to the retry policy, and the
+        requests to a device (but events streams) go through the circuit
+        breaker. A request to a device timing out raises DeviceTimeoutError.
+        """
+        breaker = None
+        if device_id is not None and endpoint != instrumentation.EVENTS:
+            breaker = self.circuit_breaker
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before_request(device_id)
+            try:
+                json = await self._send(endpoint, device_id, method, path, **kwargs)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record(device_id, e)
+                delay = None
+                if self.retry is not None:
+                    delay = self.retry.delay(attempt, e, endpoint, NETWORK_ERRORS)
+                if delay is None:
+                    timeout = device_timeout_error(e, endpoint, device_id)
+                    if timeout is not None:
+                        raise timeout
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                if breaker is not None:
+                    breaker.record(device_id)
+                return json
+
+    async def _send(self, endpoint, device_id, method, path, params=None, data=None, auth=None, timeout=None):
+        """Sends a request once, calling the instruments around it."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        kwargs = {'params': params, 'data': data}
+        if auth is not None:
+            credentials = base64.b64encode(':'.join(auth).encode('utf-8')).decode('ascii')
+            kwargs['headers'] = {'Authorization': 'Basic ' + credentials}
+        if aiohttp is not None:
+            if timeout is None:
+                timeout = operation_timeout(self.timeout, self.timeouts, self.adaptive_timeout, endpoint, device_id)
+            if isinstance(timeout, (tuple, list)):
+                kwargs['timeout'] = aiohttp.ClientTimeout(total=None, sock_connect=timeout[0], sock_read=timeout[1])
+            else:
+                kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self._semaphore:
+            if self.scheduler is not None:
+                await _acquire(self.scheduler, endpoint)
+            for instrument in self.instruments:
+                instrument.before_request(endpoint, device_id)
+            status = None
+            error = None
+            start = instrumentation.clock()
+            try:
+                async with self._get_session().request(method, self.api_url + path, **kwargs) as r:
+                    status = r.status
+                    if r.status != 200:
+                        self._check_error(r.status, await self._error_json(r), device_id)
+                    return await r.json()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                duration = instrumentation.clock() - start
+                for instrument in self.instruments:
+                    instrument.after_request(endpoint, device_id, status, duration, error)
+
+    async def _coalesce(self, key, factory):
+        """Awaits factory(), or the call in progress for key, so that
+        identical concurrent requests share one HTTP call."""
+        future = self._flights.get(key)
+        if future is None:
+            future = self._flights[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda f: self._flights.pop(key, None))
+        return await asyncio.shield(future)
+
+    def _params(self):
+        return {'access_token': self.access_token}
+
+    async def devices(self):
+        """Returns a dictionary of devices known to the user account.
+
+        The dictionary is cached for ttl seconds and refreshed incrementally
+        like SparkCloud.devices. The details of the changed devices are all
+        fetched concurrently and a device whose details cannot be fetched is
+        still listed, its error being kept in device_errors.
+        """
+        if self._devices_lock is None:
+            self._devices_lock = asyncio.Lock()
+        async with self._devices_lock:
+            if self._devices is None or time.time() - self._devices_time >= self.ttl:
+                json_list = await self._request(instrumentation.DEVICES, None, 'GET', '/v1/devices', params=self._params())
+                device_ids = self._changed_device_ids(json_list)
+                results = await asyncio.gather(
+                    *[self._get_device_info(device_id) for device_id in device_ids],
+                    return_exceptions=True
+                )
+                self._devices = self._build_devices(json_list, dict(zip(device_ids, results)))
+                self._devices_time = time.time()
+            return self._devices
+
+    async def _get_device_info(self, device_id):
+        """Queries the Spark Cloud for detailed information about a device."""
+        return await self._coalesce(
+            ('device', device_id),
+            lambda: self._request(instrumentation.DEVICE_INFO, device_id, 'GET', '/v1/devices/' + device_id, params=self._params())
+        )
+
+    async def read_variables(self, variables, devices=None):
+        """Reads several variables of several devices concurrently.
+
+        Same as SparkCloud.read_variables: returns a list of VariableResult,
+        one per (device, variable) pair.
+        """
+        pairs = self._variable_pairs(await self.devices(), variables, devices)
+        results = await asyncio.gather(
+            *[device.read_variable(variable) for device, variable in pairs],
+            return_exceptions=True
+        )
+        return [
+            VariableResult(device.name, variable, None, result)
+            if isinstance(result, Exception) else
+            VariableResult(device.name, variable, result, None)
+            for (device, variable), result in zip(pairs, results)
+        ]
+
+    async def broadcast(self, function, args=(), devices=None):
+        """Calls a function on several devices concurrently.
+
+        Same as SparkCloud.broadcast: returns a list of FunctionResult, one
+        per device. The concurrency is capped by max_concurrency.
+        """
+        devices = await self._broadcast_targets(function, devices)
+        results = await asyncio.gather(
+            *[device.call_function(function, *args) for device in devices],
+            return_exceptions=True
+        )
+        return [
+            FunctionResult(device.name, function, None, result)
+            if isinstance(result, Exception) else
+            FunctionResult(device.name, function, result, None)
+            for device, result in zip(devices, results)
+        ]
+
+    async def broadcast_iter(self, function, args=(), devices=None):
+        """Same as broadcast, but yields each FunctionResult as soon as its
+        call completes.
+
+        >>> async for result in spark.broadcast_iter('reboot'):
+        ...     print(result.device, result.ok)
+        """
+        async def call(device):
+            try:
+                return FunctionResult(device.name, function, await device.call_function(function, *args), None)
+            except Exception as e:
+                return FunctionResult(device.name, function, None, e)
+
+        tasks = [asyncio.ensure_future(call(device)) for device in await self._broadcast_targets(function, devices)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _broadcast_targets(self, function, devices):
+        """Returns the devices to call function on for a broadcast."""
+        devices_dict = await self.devices()
+        if devices is not None:
+            return self._select_devices(devices_dict, devices)
+        return [device for device in devices_dict.values() if _exposes_function(device, function)]
+
+    def events(self, prefix=None, **kwargs):
+        """Subscribes to the events published by the devices of the account.
+
+        Returns an asynchronous iterator of Event, only the events whose name
+        starts with prefix if given. See _subscribe for the keyword arguments.
+        """
+        return self._subscribe('/v1/devices/events', prefix, **kwargs)
+
+    async def _subscribe(self, path, prefix=None, reconnect=True, retry_delay=1.0, max_retry_delay=60.0):
+        """Iterates over the events of the events endpoint path.
+
+        The stream is only read as fast as events are consumed. When the
+        connection is lost it reconnects, waiting retry_delay seconds then
+        doubling the delay up to max_retry_delay, and resumes after the last
+        event received if the server gives event ids. It reconnects the same
+        way on 429 and 5xx errors of the Spark Cloud.
+        """
+        if prefix:
+            path += '/' + prefix
+        parser = SSEParser()
+        delay = retry_delay
+        while True:
+            headers = {}
+            if parser.last_event_id is not None:
+                headers['Last-Event-ID'] = parser.last_event_id
+            kwargs = {'params': self._params(), 'headers': headers}
+            if aiohttp is not None:
+                connect, read = split_timeout(self.timeouts.get(
+                    instrumentation.EVENTS, (split_timeout(self.timeout)[0], READ_TIMEOUT)
+                ))
+                kwargs['timeout'] = aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+            parser.reset()
+            try:
+                async with self._get_session().request('GET', self.api_url + path, **kwargs) as r:
+                    if r.status != 200:
+                        self._check_error(r.status, await self._error_json(r))
+                    delay = retry_delay
+                    async for chunk in r.content.iter_any():
+                        for sse in parser.feed(chunk):
+                            yield to_event(sse)
+            except NETWORK_ERRORS:
+                if not reconnect:
+                    raise
+            except SparkCloudError as e:
+                if not (reconnect and _is_transient(e)):
+                    raise
+            else:
+                if not reconnect:
+                    return
+            await asyncio.sleep(parser.retry or delay)
+            delay = min(delay * 2, max_retry_delay)
+
+    def _make_device_class(self, entries):
+        """Returns the Device class for the given listing fields."""
+        return _AsyncBaseDevice.make_device_class(self, entries, timeout=self.timeout)
+
+    def _device_api(self, device_id):
+        """Returns the API path of a device."""
+        return '/v1/devices/' + device_id
+
+    def __getattr__(self, name):
+        """Returns a Device object, from the last devices() result, as an
+        attribute of the AsyncSparkCloud object."""
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._devices is None:
+            raise AttributeError("{}: await devices() before accessing devices as attributes".format(name))
+        if name in self._devices:
+            return self._devices[name]
+        else:
+            raise AttributeError(name)
+
+class _AsyncBaseDevice(_BaseDevice):
+
+    """Parent class for the dynamic Device class of AsyncSparkCloud.
+
+    Functions return coroutines and variables are awaitable.
+    """
+
+    def __getattr__(self, name):
+        """Returns virtual attributes corresponding to function or variable
+        names."""
+        self._check_available(name)
+
+        if name in self.functions:
+
+            def fcall(*args):
+                return self._call_function(name, args)
+
+            return fcall
+
+        elif name in self.variables:
+            return self._read_variable(name)
+
+        else:
+            raise AttributeError()
+
+    async def call_function(self, name, *args):
+        """Calls a function of the device and returns its return value."""
+        return await _BaseDevice.call_function(self, name, *args)
+
+    async def _call_function(self, name, args):
+        json = await self.spark_cloud._request(
+            instrumentation.FUNCTION, self.id, 'POST', self.api + '/' + name,
+            params=self.spark_cloud._params(), data={'params': ','.join(args)}
+        )
+        return json['return_value']
+
+    async def read_variable(self, name):
+        """Returns the value of a variable of the device."""
+        return await _BaseDevice.read_variable(self, name)
+
+    async def read_variables(self, names):
+        """Reads several variables of the device concurrently."""
+        return await self.spark_cloud.read_variables(names, devices=[self])
+
+    def events(self, prefix=None, **kwargs):
+        """Subscribes to the events published by the device.
+
+        Same as AsyncSparkCloud.events.
+        """
+        return self.spark_cloud._subscribe(self.spark_cloud._device_api(self.id) + '/events', prefix, **kwargs)
+
+    async def _read_variable(self, name):
+        json = await self.spark_cloud._coalesce(
+            ('variable', self.id, name),
+            lambda: self.spark_cloud._request(
+                instrumentation.VARIABLE, self.id, 'GET', self.api + '/' + name, params=self.spark_cloud._params()
+            )
+        )
+        return json['result']
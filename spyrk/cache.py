@@ -0,0 +1,195 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+
+from .scheduler import priority, BACKGROUND
+
+class VariableCache(object):
+
+    """A cache of the values of device variables.
+
+    >>> cache = VariableCache(ttl=5)
+    >>> cache.set_ttl(60, variable='firmware_version')
+    >>> cache.set_ttl(1, device='captain_hamster', variable='temperature')
+    >>> spark = SparkCloud(ACCESS_TOKEN, variable_cache=cache)
+    >>> spark.captain_hamster.temperature  # fetched
+    >>> spark.captain_hamster.temperature  # cached for 1 second
+    >>> cache.invalidate(device='captain_hamster')
+    >>> print cache.hits, cache.misses
+
+    At most max_size values are kept, the least recently used being evicted
+    first.
+
+    With stale_while_revalidate set, an expired value is still returned while
+    a background thread fetches the new one, unless it expired more than
+    max_stale seconds ago (if given).
+    """
+
+    def __init__(self, ttl=10, max_size=1000, stale_while_revalidate=False, max_stale=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_stale = max_stale
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._ttls = {}
+        self._values = OrderedDict()  # (device id, variable) -> (value, time)
+        self._names = {}  # device id -> device name
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def set_ttl(self, ttl, device=None, variable=None):
+        """Sets the time to live of the values of a device (given by name or
+        id), of a variable of any device, or of a variable of a device.
+
+        The most specific setting applies. A ttl of 0 disables caching.
+        """
+        self._ttls[(device, variable)] = ttl
+
+    def ttl_for(self, device, variable):
+        """Returns the time to live of a variable of a Device object."""
+        for key in (
+            (device.id, variable), (device.name, variable),
+            (device.id, None), (device.name, None),
+            (None, variable),
+        ):
+            if key in self._ttls:
+                return self._ttls[key]
+        return self.ttl
+
+    def get(self, device, variable, fetch):
+        """Returns the value of a variable of a Device object, calling fetch()
+        to get it if it is not cached or expired."""
+        ttl = self.ttl_for(device, variable)
+        if not ttl:
+            return fetch()
+
+        key = (device.id, variable)
+        now = time.time()
+        with self._lock:
+            self._names[device.id] = device.name
+            entry = self._values.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < ttl:
+                    self._touch(key)
+                    self.hits += 1
+                    return value
+                if self.stale_while_revalidate and (self.max_stale is None or age < ttl + self.max_stale):
+                    self._touch(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        thread = threading.Thread(target=self._revalidate, args=(key, fetch))
+                        thread.daemon = True
+                        thread.start()
+                    return value
+            self.misses += 1
+
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def _touch(self, key):
+        entry = self._values.pop(key)
+        self._values[key] = entry
+
+    def _store(self, key, value):
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = (value, time.time())
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self.evictions += 1
+
+    def _revalidate(self, key, fetch):
+        try:
+            with priority(BACKGROUND):
+                self._store(key, fetch())
+        except Exception:
+            # keep serving the stale value, the next read will try again
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, device=None, variable=None):
+        """Forgets the cached values of a device (given by name, id or Device
+        object), of a variable, of a variable of a device, or everything."""
+        device = getattr(device, 'id', device)
+        with self._lock:
+            for key in list(self._values):
+                if device is not None and device not in (key[0], self._names.get(key[0])):
+                    continue
+                if variable is not None and key[1] != variable:
+                    continue
+                del self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+
+    """Coalesces identical calls made concurrently by several threads.
+
+    >>> flight = SingleFlight()
+    >>> flight.do(('variable', device_id, 'temperature'), fetch)
+
+    While a call for a key is in progress, other calls for the same key wait
+    for it and get its result, or its exception raised again, instead of
+    calling their own function.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func):
+        """Calls func(), or waits for the call in progress for key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,201 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SNAPSHOT_VERSION = 1
+
+def atomic_write_json(path, data):
+    """Writes data as JSON to path through a temporary file renamed over it,
+    so that readers see either the previous or the new content. The file is
+    only readable by its owner."""
+    atomic_write(path, json.dumps(data, default=_to_json))
+
+def _to_json(obj):
+    """Converts the read-only mappings of device details for json.dumps."""
+    if hasattr(obj, 'keys'):
+        return dict(obj)
+    raise TypeError("{!r} is not JSON serializable".format(obj))
+
+def atomic_write(path, text):
+    """Writes text to path like atomic_write_json."""
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.spyrk-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+class CatalogSnapshot(object):
+
+    """A file keeping the devices discovered on an account, to start without
+    waiting for the discovery.
+
+    >>> spark = SparkCloud(ACCESS_TOKEN, snapshot='~/.spyrk/devices.json')
+
+    The file holds the devices listing entries along with the details
+    (functions, variables, status) of each connected device. It is written
+    atomically: readers see either the previous or the new snapshot. Only a
+    digest of the last snapshot is kept in memory, to skip identical writes.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._saved = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Returns the devices listing and the dictionary of device details
+        of the snapshot, or None if there is no usable snapshot."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+            return None
+
+        try:
+            json_list = [entry['listing'] for entry in data['devices']]
+            infos = dict(
+                (entry['listing']['id'], entry['info'])
+                for entry in data['devices'] if entry['info'] is not None
+            )
+        except (KeyError, TypeError):
+            return None  # not a snapshot written by Spyrk
+        self._saved = self._digest(data['devices'])
+        return json_list, infos
+
+    def save(self, entries):
+        """Writes the snapshot of a list of (listing, info) pairs, unless it is
+        the same as the last one loaded or saved."""
+        devices = [{'listing': listing, 'info': info} for listing, info in entries]
+        digest = self._digest(devices)
+        with self._lock:
+            if digest == self._saved:
+                return
+            atomic_write_json(self.path, {
+                'version': SNAPSHOT_VERSION,
+                'saved_at': time.time(),
+                'devices': devices,
+            })
+            self._saved = digest
+            
+    @staticmethod
+    def _digest(devices):
+        text = json.dumps(devices, sort_keys=True, default=_to_json)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class SharedCatalog(CatalogSnapshot):
+
+    """A catalog file shared by several processes, so that a single one of
+    them discovers the devices for all.
+
+    >>> spark = SparkCloud(ACCESS_TOKEN, shared_catalog='/tmp/spyrk-devices.json')
+
+    When the devices in the file are older than ttl seconds, the first
+    process needing them takes a lock (a lock file, on POSIX systems) and
+    refreshes them from the Spark Cloud, details of every device included.
+    The other processes keep reading the previous devices meanwhile, or wait
+    for it if there are none yet. Processes read the file again only when it
+    changed, and never query the Spark Cloud for the devices.
+    """
+
+    def __init__(self, path, ttl=10):
+        super(SharedCatalog, self).__init__(path)
+        self.ttl = ttl
+        self.lock_path = self.path + '.lock'
+        self._stat = None
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def exists(self):
+        """Tells if the catalog file exists."""
+        return os.path.exists(self.path)
+
+    def changed(self):
+        """Tells if the file changed since this process last read or wrote
+        it."""
+        return self._stat is None or self._file_stat() != self._stat
+
+    def is_fresh(self):
+        """Tells if the devices were refreshed less than ttl seconds ago."""
+        try:
+            refreshed_at = os.stat(self.lock_path).st_mtime
+        except OSError:
+            return False
+        return self.exists() and time.time() - refreshed_at < self.ttl
+
+    def mark_refreshed(self):
+        """Records that the devices were just refreshed, whether the file
+        changed or not."""
+        with open(self.lock_path, 'a'):
+            os.utime(self.lock_path, None)
+
+    def load(self):
+        stat = self._file_stat()
+        loaded = super(SharedCatalog, self).load()
+        if loaded is not None:
+            self._stat = stat
+        return loaded
+
+    def save(self, entries):
+        super(SharedCatalog, self).save(entries)
+        self._stat = self._file_stat()
+
+    @contextmanager
+    def refresh_lock(self, blocking=False):
+        """Context manager taking the lock of the processes refreshing the
+        catalog. It gives True if this process got the lock, False if another
+        one holds it (when not blocking)."""
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if fcntl is None:
+            yield True
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except (IOError, OSError):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,74 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Exceptions raised for the errors returned by the Spark Cloud.
+
+>>> try:
+...     spark.my_device.temperature
+... except DeviceTimeoutError:
+...     print 'my_device did not answer'
+"""
+
+class SparkCloudError(Exception):
+
+    """An error returned by the Spark Cloud.
+
+    status is the HTTP status code of the reply, error and description the
+    error message, and device_id the device the request was about, if any.
+    """
+
+    def __init__(self, error, description='', status=None, device_id=None):
+        super(SparkCloudError, self).__init__(
+            '{}: {}'.format(error, description) if description else error
+        )
+        self.error = error
+        self.description = description
+        self.status = status
+        self.device_id = device_id
+
+class AuthenticationError(SparkCloudError):
+
+    """The credentials or the access token were refused."""
+
+class DeviceTimeoutError(SparkCloudError):
+
+    """The device did not answer in time."""
+
+class DeviceOfflineError(SparkCloudError, IOError):
+
+    """The device is not connected to the Spark Cloud. It is also an
+    IOError, as raised by earlier versions."""
+
+class CircuitOpenError(DeviceTimeoutError):
+
+    """The request was not sent because the device kept timing out: its
+    circuit breaker is open."""
+
+def error_from_reply(status, json, device_id=None):
+    """Returns the SparkCloudError matching an error reply of the Spark
+    Cloud, json being its decoded body (or None if it is not JSON)."""
+    if not isinstance(json, dict):
+        json = {}
+    error = json.get('error') or 'HTTP error {}'.format(status)
+    description = json.get('error_description') or json.get('info') or ''
+    if status == 408:
+        cls = DeviceTimeoutError
+    elif status in (401, 403) or error in ('invalid_token', 'invalid_grant', 'invalid_client'):
+        cls = AuthenticationError
+    elif 'not connected' in error.lower() or 'offline' in error.lower():
+        cls = DeviceOfflineError
+    else:
+        cls = SparkCloudError
+    return cls(error, description, status, device_id)
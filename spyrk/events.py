@@ -0,0 +1,246 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+from .errors import SparkCloudError
+
+# The Spark Cloud sends a keep-alive comment every few seconds: no data for
+# this long means the connection is dead.
+READ_TIMEOUT = 60
+
+Event = namedtuple('Event', ['name', 'data', 'ttl', 'published_at', 'coreid'])
+Event.__doc__ = """An event published by a device or through the Spark Cloud API."""
+
+def _is_transient(error):
+    """Tells if a subscription refused with error may succeed later: the
+    Spark Cloud was overloaded or failing rather than denying access."""
+    status = getattr(error, 'status', None) if isinstance(error, SparkCloudError) else None
+    return status is not None and (status in (408, 429) or status >= 500)
+
+ServerSentEvent = namedtuple('ServerSentEvent', ['event', 'data', 'id'])
+
+class SSEParser(object):
+
+    """Incremental parser of a server-sent events stream.
+
+    >>> parser = SSEParser()
+    >>> for chunk in response.iter_content(chunk_size=None):
+    ...     for event in parser.feed(chunk):
+    ...         print event
+
+    Chunks can be cut anywhere, incomplete lines are kept until the next
+    chunk. The id of the last event is kept in last_event_id to resume the
+    stream after a reconnection.
+    """
+
+    def __init__(self):
+        self.last_event_id = None
+        self.retry = None
+        self.reset()
+
+    def reset(self):
+        """Forgets the incomplete event, when the connection was lost."""
+        self._buffer = b''
+        self._event = None
+        self._data = []
+
+    def feed(self, chunk):
+        """Parses a chunk of the stream and returns the list of the
+        ServerSentEvent it completes."""
+        lines = (self._buffer + chunk).split(b'\n')
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(ServerSentEvent(
+                        self._event.decode('utf-8') if self._event else 'message',
+                        b'\n'.join(self._data).decode('utf-8'),
+                        self.last_event_id
+                    ))
+                self._event = None
+                self._data = []
+                continue
+            if line.startswith(b':'):
+                continue
+            field, _, value = line.partition(b':')
+            if value.startswith(b' '):
+                value = value[1:]
+            if field == b'data':
+                self._data.append(value)
+            elif field == b'event':
+                self._event = value
+            elif field == b'id':
+                self.last_event_id = value.decode('utf-8')
+            elif field == b'retry' and value.isdigit():
+                self.retry = int(value) / 1000.0
+        return events
+
+def to_event(sse):
+    """Converts a ServerSentEvent of the Spark Cloud into an Event."""
+    try:
+        payload = json.loads(sse.data)
+    except ValueError:
+        return Event(sse.event, sse.data, None, None, None)
+    if not isinstance(payload, dict):
+        return Event(sse.event, payload, None, None, None)
+    return Event(
+        sse.event, payload.get('data'), payload.get('ttl'),
+        payload.get('published_at'), payload.get('coreid')
+    )
+
+class EventStream(object):
+
+    """A subscription to a stream of events of the Spark Cloud.
+
+    >>> with spark.events('temperature') as stream:
+    ...     for event in stream:
+    ...         print event.coreid, event.data
+
+    A background thread reads the stream into a buffer of at most buffer_size
+    events. If the consumer is too slow, the oldest events are dropped and
+    counted in dropped. When the connection is lost the stream reconnects,
+    waiting retry_delay seconds then doubling the delay up to max_retry_delay,
+    and resumes after the last event received if the server gives event ids.
+    It reconnects the same way when the Spark Cloud is overloaded or failing
+    (429 and 5xx errors), but other errors, like a refused access token, end
+    the stream.
+    """
+
+    def __init__(self, connect, buffer_size=1000, reconnect=True, retry_delay=1.0, max_retry_delay=60.0):
+        """Subscribes to the stream.
+
+        connect is called with the headers to send and returns a streaming
+        requests response, raising an exception if the Spark Cloud refuses the
+        subscription.
+        """
+        self.buffer_size = buffer_size
+        self.reconnect = reconnect
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.dropped = 0
+        self.reconnections = 0
+        self._connect = connect
+        self._parser = SSEParser()
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._response = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        delay = self.retry_delay
+        while not self._closed:
+            try:
+                headers = {}
+                if self._parser.last_event_id is not None:
+                    headers['Last-Event-ID'] = self._parser.last_event_id
+                self._parser.reset()
+                self._response = self._connect(headers)
+                delay = self.retry_delay
+                for chunk in self._response.iter_content(chunk_size=None):
+                    events = self._parser.feed(chunk)
+                    if events:
+                        self._push(events)
+                    if self._closed:
+                        return
+            except IOError as e:
+                # network errors, including the ones of requests
+                if self._closed:
+                    return
+                if not self.reconnect:
+                    self._stop(e)
+                    return
+            except Exception as e:
+                if self._closed:
+                    return
+                if not (self.reconnect and _is_transient(e)):
+                    # the Spark Cloud refused the subscription
+                    self._stop(e)
+                    return
+            else:
+                if not self.reconnect:
+                    self._stop(None)
+                    return
+            self._response = None
+            self.reconnections += 1
+            time.sleep(self._parser.retry or delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def _push(self, events):
+        with self._condition:
+            for sse in events:
+                if len(self._buffer) >= self.buffer_size:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                self._buffer.append(to_event(sse))
+            self._condition.notify()
+
+    def _stop(self, error):
+        with self._condition:
+            self._error = error
+            self._closed = True
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        """Returns the next event, waiting at most timeout seconds.
+
+        Returns None on timeout. Raises StopIteration once the stream is
+        closed and its buffer empty, or the error which ended the stream.
+        """
+        with self._condition:
+            if not self._buffer and not self._closed:
+                self._condition.wait(timeout)
+            if self._buffer:
+                return self._buffer.popleft()
+            if self._closed:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                raise StopIteration()
+            return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            event = self.get()
+            if event is not None:
+                return event
+
+    next = __next__  # Python 2
+
+    def close(self):
+        """Stops the subscription."""
+        self._stop(None)
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,244 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A local stand-in for the Spark Cloud, to test and benchmark without
+network access nor real devices.
+
+>>> with FakeCloud(devices=100, latency=0.05, offline=5) as cloud:
+...     spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url))
+...     print spark.device0042.temperature
+"""
+
+import errno
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+ACCESS_TOKEN = '254406f79c1999af65a7df4388971354f85cfee9'
+
+VARIABLES = {'temperature': 'double', 'state': 'string'}
+FUNCTIONS = ['digitalread', 'digitalwrite', 'analogread', 'analogwrite']
+
+_HANG_UPS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # clients hang up on slow replies when they time out: not an error
+        error = sys.exc_info()[1]
+        if isinstance(error, socket.error) and error.errno in _HANG_UPS:
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+class FakeCloud(object):
+
+    """An HTTP server implementing the Spark Cloud endpoints used by Spyrk:
+    /oauth/token, the devices listing, device details, variables, functions
+    and events publishing.
+
+    devices is the number of devices of the account, named device0000,
+    device0001... The last offline ones are reported connected but do not
+    answer: their requests take offline_timeout seconds and fail with a 408
+    error, like the Spark Cloud does. The first disconnected ones after them
+    are listed as not connected.
+
+    Each device request takes latency seconds, or latency(device_id)
+    seconds if latency is callable. A device request fails with a 500 error
+    with probability error_rate, as does publishing an event.
+
+    published lists the events published, as dictionaries of their name,
+    data, private and ttl parameters. requests counts the requests received per endpoint type.
+    """
+
+    def __init__(self, devices=10, latency=0.0, offline=0, offline_timeout=30.0,
+                 disconnected=0, error_rate=0.0, seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.offline_timeout = offline_timeout
+        self.error_rate = error_rate
+        self.access_token = ACCESS_TOKEN
+        self.requests = defaultdict(int)
+        self.published = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.devices = []
+        for i in range(devices):
+            self.devices.append({
+                'id': '{:024x}'.format(0x53ff6e0666675748454 + i),
+                'name': 'device{:04d}'.format(i),
+                'last_app': None,
+                'last_ip_address': '172.0.0.1',
+                'last_heard': '2015-06-02T20:56:28.532Z',
+                'product_id': 6,
+                'connected': i < devices - disconnected,
+            })
+        self.offline_ids = set(
+            d['id'] for d in self.devices[max(devices - disconnected - offline, 0):devices - disconnected]
+        )
+        self._by_id = dict((d['id'], d) for d in self.devices)
+
+        cloud = self
+
+        class Handler(_Handler):
+            pass
+        Handler.cloud = cloud
+        self._server = _Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        """The root URL of the server, to give to Hammock."""
+        return 'http://{}:{}'.format(*self._server.server_address[:2])
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _device_delay(self, device_id):
+        if callable(self.latency):
+            return self.latency(device_id)
+        return self.latency
+
+    def _fails(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def handle(self, method, path, params):
+        """Returns the (status, JSON reply) of a request."""
+        parts = [part for part in path.split('/') if part]
+        if method == 'POST' and parts == ['oauth', 'token']:
+            self._count('login')
+            if params.get('username') and params.get('password') or params.get('refresh_token'):
+                return 200, {
+                    'access_token': self.access_token, 'token_type': 'bearer',
+                    'expires_in': 7776000, 'refresh_token': 'fake-refresh-token',
+                }
+            return 400, {'error': 'invalid_grant', 'error_description': 'User credentials are invalid'}
+
+        if params.get('access_token') != self.access_token:
+            return 401, {'error': 'invalid_token', 'error_description': 'The access token provided is invalid.'}
+
+        if parts[:2] != ['v1', 'devices']:
+            return 404, {'error': 'Not found', 'error_description': path}
+        if len(parts) == 2 and method == 'GET':
+            self._count('devices')
+            return 200, self.devices
+        if parts[2:] == ['events'] and method == 'POST':
+            self._count('publish')
+            if self._fails():
+                return 500, {'error': 'Internal error', 'error_description': 'Injected error.'}
+            if not params.get('name'):
+                return 400, {'error': 'Missing event name', 'error_description': 'name is required'}
+            with self._lock:
+                self.published.append(dict(
+                    (key, params.get(key)) for key in ('name', 'data', 'private', 'ttl')
+                ))
+            return 200, {'ok': True}
+
+        device = self._by_id.get(parts[2])
+        if device is None or len(parts) > 4:
+            return 404, {'error': 'Permission Denied', 'error_description': 'Invalid device ID'}
+        endpoint = 'device_info' if len(parts) == 3 else 'function' if method == 'POST' else 'variable'
+        self._count(endpoint)
+
+        if device['id'] in self.offline_ids:
+            time.sleep(self.offline_timeout)
+            return 408, {'error': 'Timed out.', 'error_description': 'The device did not answer.'}
+        delay = self._device_delay(device['id'])
+        if delay:
+            time.sleep(delay)
+        if self._fails():
+            return 500, {'error': 'Internal error', 'error_description': 'Injected error.'}
+
+        if endpoint == 'device_info':
+            info = dict(device)
+            info.update({'variables': VARIABLES, 'functions': FUNCTIONS, 'status': 'normal'})
+            return 200, info
+        if not device['connected']:
+            return 400, {'error': 'Device not connected', 'error_description': device['name']}
+        name = parts[3]
+        if endpoint == 'function':
+            if name not in FUNCTIONS:
+                return 404, {'error': 'Function not found', 'error_description': name}
+            return 200, {'id': device['id'], 'name': name, 'connected': True, 'return_value': 1}
+        if name not in VARIABLES:
+            return 404, {'error': 'Variable not found', 'error_description': name}
+        result = 21.5 if name == 'temperature' else 'idle'
+        return 200, {'cmd': 'VarReturn', 'name': name, 'result': result, 'coreInfo': {'deviceID': device['id']}}
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    cloud = None
+
+    def _reply(self, method):
+        url = urlparse(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            params.update((k, v[0]) for k, v in parse_qs(body).items())
+        status, reply = self.cloud.handle(method, url.path, params)
+        body = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply('GET')
+
+    def do_POST(self):
+        self._reply('POST')
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,145 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import defaultdict
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# Types of requests sent to the Spark Cloud, given as endpoint to instruments.
+LOGIN = 'login'
+DEVICES = 'devices'
+DEVICE_INFO = 'device_info'
+VARIABLE = 'variable'
+FUNCTION = 'function'
+EVENTS = 'events'
+PUBLISH = 'publish'
+
+# Upper bounds of the latency histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Instrument(object):
+
+    """Hooks called around each request sent to the Spark Cloud.
+
+    >>> class Printer(Instrument):
+    ...     def after_request(self, endpoint, device_id, status, duration, error):
+    ...         print endpoint, device_id, status, duration
+    >>> spark = SparkCloud(ACCESS_TOKEN, instruments=[Printer()])
+
+    endpoint is one of LOGIN, DEVICES, DEVICE_INFO, VARIABLE, FUNCTION,
+    EVENTS or PUBLISH, device_id is None for the requests not about a device. Hooks must
+    be thread safe and should not raise.
+    """
+
+    def before_request(self, endpoint, device_id):
+        """Called before sending a request."""
+
+    def after_request(self, endpoint, device_id, status, duration, error):
+        """Called once a request is done.
+
+        status is the HTTP status code, or None if no reply was received.
+        duration is in seconds. error is the exception raised, if any.
+        """
+
+class MetricsCollector(Instrument):
+
+    """An Instrument keeping in memory, per endpoint, a histogram of the
+    request latencies, the number of errors per status and the number of
+    requests in flight.
+
+    >>> metrics = MetricsCollector()
+    >>> spark = SparkCloud(ACCESS_TOKEN, instruments=[metrics])
+    >>> print metrics.prometheus_text()
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='spyrk'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._sums = defaultdict(float)
+        self._errors = defaultdict(int)
+        self._in_flight = defaultdict(int)
+
+    def before_request(self, endpoint, device_id):
+        with self._lock:
+            self._in_flight[endpoint] += 1
+
+    def after_request(self, endpoint, device_id, status, duration, error):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                index = i
+                break
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            self._counts[endpoint][index] += 1
+            self._sums[endpoint] += duration
+            if error is not None:
+                label = str(status) if status is not None else type(error).__name__
+                self._errors[(endpoint, label)] += 1
+
+    def collect(self):
+        """Returns a snapshot of the metrics as a dictionary.
+
+        'latency' maps each endpoint to its cumulative histogram: a list of
+        (upper bound, count) pairs ending with (float('inf'), total count),
+        and its sum of durations. 'errors' maps (endpoint, status) pairs to
+        counts, the status being the exception class name when no reply was
+        received. 'in_flight' maps endpoints to the requests in progress.
+        """
+        with self._lock:
+            latency = {}
+            for endpoint, counts in self._counts.items():
+                cumulative, total = [], 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    total += count
+                    cumulative.append((bound, total))
+                latency[endpoint] = {'buckets': cumulative, 'count': total, 'sum': self._sums[endpoint]}
+            return {
+                'latency': latency,
+                'errors': dict(self._errors),
+                'in_flight': dict(self._in_flight),
+            }
+
+    def prometheus_text(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        metrics = self.collect()
+        name = self.prefix + '_request_duration_seconds'
+        lines = [
+            '# HELP {} Latency of the requests to the Spark Cloud.'.format(name),
+            '# TYPE {} histogram'.format(name),
+        ]
+        for endpoint, histogram in sorted(metrics['latency'].items()):
+            for bound, count in histogram['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('{}_bucket{{endpoint="{}",le="{}"}} {}'.format(name, endpoint, le, count))
+            lines.append('{}_sum{{endpoint="{}"}} {}'.format(name, endpoint, histogram['sum']))
+            lines.append('{}_count{{endpoint="{}"}} {}'.format(name, endpoint, histogram['count']))
+
+        name = self.prefix + '_request_errors_total'
+        lines.append('# HELP {} Failed requests to the Spark Cloud.'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        for (endpoint, status), count in sorted(metrics['errors'].items()):
+            lines.append('{}{{endpoint="{}",status="{}"}} {}'.format(name, endpoint, status, count))
+
+        name = self.prefix + '_requests_in_flight'
+        lines.append('# HELP {} Requests to the Spark Cloud in progress.'.format(name))
+        lines.append('# TYPE {} gauge'.format(name))
+        for endpoint, count in sorted(metrics['in_flight'].items()):
+            lines.append('{}{{endpoint="{}"}} {}'.format(name, endpoint, count))
+        return '\n'.join(lines) + '\n'
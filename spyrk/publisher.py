@@ -0,0 +1,160 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import deque, namedtuple
+
+from .spark_cloud import DEFAULT_MAX_WORKERS, _parallel_map
+
+OutgoingEvent = namedtuple('OutgoingEvent', ['name', 'data', 'private', 'ttl', 'queued_at'])
+OutgoingEvent.__doc__ = """An event queued by an EventPublisher."""
+
+class EventPublisher(object):
+
+    """Publishes events in the background, so that publishing never waits
+    for the network.
+
+    >>> publisher = EventPublisher(spark, batch_size=100, flush_interval=1).start()
+    >>> publisher.publish('temperature', '21.5')
+    >>> publisher.close()
+
+    Events are queued, at most max_queue of them: publish returns False and
+    counts the event in dropped when the queue is full. A background thread
+    sends the queued events once batch_size of them are waiting, once the
+    oldest has waited flush_interval seconds, or when flush is called. The
+    events of a batch are sent concurrently by at most max_workers threads,
+    through the session and the scheduler of spark_cloud.
+
+    on_error is called with the OutgoingEvent and the exception of each
+    event which could not be published, from the background thread. The
+    events published and failed are counted in sent and failed.
+    """
+
+    def __init__(self, spark_cloud, max_queue=10000, batch_size=100, flush_interval=1.0, max_workers=None, on_error=None):
+        self.spark_cloud = spark_cloud
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_workers = max_workers
+        self.on_error = on_error
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._events = deque()
+        self._queued = 0  # events accepted so far
+        self._done = 0  # events sent or failed so far
+        self._flush_until = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """Starts sending in a background thread."""
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """Sends the queued events and stops the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Number of events waiting to be sent."""
+        return len(self._events)
+
+    def publish(self, name, data=None, private=False, ttl=60):
+        """Queues an event and returns True, or returns False if the queue is
+        full. See SparkCloud.publish for the arguments."""
+        with self._cond:
+            if self._closed or len(self._events) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._events.append(OutgoingEvent(name, data, private, ttl, time.time()))
+            self._queued += 1
+            # wake the sender up for a full batch, or to time the first event
+            if len(self._events) == 1 or len(self._events) == self.batch_size:
+                self._cond.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """Sends the events queued so far right away and waits for them to be
+        sent or to fail. Returns False if timeout seconds elapsed first."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            target = self._queued
+            self._flush_until = max(self._flush_until, target)
+            self._cond.notify_all()
+            while self._done < target:
+                if self._thread is None:
+                    raise RuntimeError("the EventPublisher is not started")
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _next_batch(self):
+        """Waits for a batch to send and returns it, or returns None once
+        closed with no event left."""
+        with self._cond:
+            while True:
+                if self._events:
+                    wait = self._events[0].queued_at + self.flush_interval - time.time()
+                    if (len(self._events) >= self.batch_size or wait <= 0 or self._closed or
+                            self._flush_until > self._done):
+                        count = min(self.batch_size, len(self._events))
+                        return [self._events.popleft() for _ in range(count)]
+                elif self._closed:
+                    return None
+                else:
+                    wait = None
+                self._cond.wait(wait)
+
+    def _run(self):
+        max_workers = self.max_workers or self.spark_cloud.max_workers or DEFAULT_MAX_WORKERS
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            results = _parallel_map(self._send, batch, max_workers)
+            failures = [(event, error) for event, _, error in results if error is not None]
+            for event, error in failures:
+                if self.on_error is not None:
+                    try:
+                        self.on_error(event, error)
+                    except Exception:
+                        pass  # a failing callback must not stop the sender
+            with self._cond:
+                self.sent += len(batch) - len(failures)
+                self.failed += len(failures)
+                self._done += len(batch)
+                self._cond.notify_all()
+
+    def _send(self, event):
+        self.spark_cloud.publish(event.name, event.data, event.private, event.ttl)
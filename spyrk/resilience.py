@@ -0,0 +1,181 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import socket
+import threading
+
+import requests
+
+from . import instrumentation
+from .errors import SparkCloudError, DeviceTimeoutError, CircuitOpenError
+
+try:
+    import asyncio
+    _ASYNC_TIMEOUTS = (asyncio.TimeoutError,)
+except ImportError:  # Python 2
+    _ASYNC_TIMEOUTS = ()
+
+# Errors meaning a device did not answer in time.
+TIMEOUT_ERRORS = (DeviceTimeoutError, requests.exceptions.Timeout, socket.timeout) + _ASYNC_TIMEOUTS
+
+# Requests answered by a device rather than by the Spark Cloud alone.
+DEVICE_ENDPOINTS = (instrumentation.VARIABLE, instrumentation.FUNCTION, instrumentation.DEVICE_INFO)
+
+def device_timeout_error(error, endpoint, device_id):
+    """Returns the DeviceTimeoutError to raise for a request to a device
+    which timed out on the client with error, or None if error is not such a
+    timeout. The original exception is kept as __cause__."""
+    if (endpoint not in DEVICE_ENDPOINTS or not isinstance(error, TIMEOUT_ERRORS) or
+            isinstance(error, SparkCloudError)):
+        return None
+    timeout = DeviceTimeoutError('Timed out.', 'No reply in time ({})'.format(error or type(error).__name__), None, device_id)
+    timeout.__cause__ = error
+    return timeout
+
+class RetryPolicy(object):
+
+    """Tells which failed requests to send again and after how long.
+
+    >>> spark = SparkCloud(ACCESS_TOKEN, retry=RetryPolicy(retries=3, backoff=0.5))
+
+    A request failing with a transient error (a network error or one of the
+    HTTP statuses) is sent again up to retries times. The n-th retry waits
+    for a random delay up to backoff * 2 ** n seconds, capped to max_backoff
+    ("full jitter", so that clients failing together do not retry together).
+
+    Devices not answering (DeviceTimeoutError, or a request to a device
+    timing out on the client) are not retried: the Spark Cloud or the client
+    already waited for them, a CircuitBreaker is the way to deal with them. Function calls and published events are not idempotent and are
+    only retried if retry_functions, respectively retry_publish, is set.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=10.0, jitter=True,
+                 statuses=(429, 500, 502, 503, 504), retry_functions=False, retry_publish=False):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.retry_functions = retry_functions
+        self.retry_publish = retry_publish
+        self._random = random.Random()
+
+    def is_transient(self, error, network_errors=(IOError,)):
+        """Tells if a request failing with error may succeed if sent again."""
+        if isinstance(error, DeviceTimeoutError):
+            return False
+        if isinstance(error, SparkCloudError):
+            return error.status in self.statuses
+        return isinstance(error, network_errors)
+
+    def delay(self, attempt, error, endpoint, network_errors=(IOError,)):
+        """Returns the seconds to wait before sending again a request which
+        failed with error after attempt retries, or None to give up."""
+        if attempt >= self.retries or endpoint == instrumentation.EVENTS:
+            return None
+        if endpoint == instrumentation.FUNCTION and not self.retry_functions:
+            return None
+        if endpoint == instrumentation.PUBLISH and not self.retry_publish:
+            return None
+        if endpoint in DEVICE_ENDPOINTS and isinstance(error, TIMEOUT_ERRORS):
+            return None
+        if not self.is_transient(error, network_errors):
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = self._random.uniform(0, delay)
+        return delay
+
+class _Circuit(object):
+
+    __slots__ = ('failures', 'opened_at', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+class CircuitBreaker(object):
+
+    """Fails fast the requests to devices which keep timing out.
+
+    >>> spark = SparkCloud(ACCESS_TOKEN, circuit_breaker=CircuitBreaker(failures=3, cooldown=30))
+
+    After failures timeouts in a row, the circuit of a device opens: its
+    requests raise CircuitOpenError at once instead of waiting for the
+    timeout. Once cooldown seconds elapsed, a single request is let through
+    as a probe: the circuit closes if the device answers and opens again for
+    another cooldown if it does not. Any reply from the device, even an
+    error, counts as an answer.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=3, cooldown=30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def state(self, device_id):
+        """Returns the state of the circuit of a device: CLOSED, OPEN or
+        HALF_OPEN."""
+        with self._lock:
+            circuit = self._circuits.get(device_id)
+            if circuit is None or circuit.opened_at is None:
+                return self.CLOSED
+            if circuit.probing or instrumentation.clock() - circuit.opened_at >= self.cooldown:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def open_circuits(self):
+        """Returns the ids of the devices whose circuit is not closed."""
+        with self._lock:
+            return [device_id for device_id, c in self._circuits.items() if c.opened_at is not None]
+
+    def before_request(self, device_id):
+        """Raises CircuitOpenError if a request to the device must not be
+        sent."""
+        with self._lock:
+            circuit = self._circuits.get(device_id)
+            if circuit is None or circuit.opened_at is None:
+                return
+            remaining = circuit.opened_at + self.cooldown - instrumentation.clock()
+            if remaining <= 0 and not circuit.probing:
+                circuit.probing = True
+                return
+        raise CircuitOpenError(
+            'Circuit open',
+            'the device did not answer {} times, retrying in {:.1f}s'.format(
+                circuit.failures, max(remaining, 0)
+            ),
+            device_id=device_id
+        )
+
+    def record(self, device_id, error=None):
+        """Records the outcome of a request to the device, error being the
+        exception raised if it failed."""
+        with self._lock:
+            if error is None or not isinstance(error, TIMEOUT_ERRORS):
+                self._circuits.pop(device_id, None)
+                return
+            circuit = self._circuits.setdefault(device_id, _Circuit())
+            circuit.failures += 1
+            if circuit.probing or circuit.failures >= self.failures:
+                circuit.opened_at = instrumentation.clock()
+            circuit.probing = False
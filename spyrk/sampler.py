@@ -0,0 +1,200 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy  # pip install numpy
+except ImportError:
+    numpy = None
+
+from .scheduler import priority, BACKGROUND
+from .spark_cloud import DEFAULT_MAX_WORKERS, _parallel_map
+
+class RingBuffer(object):
+
+    """A fixed-size time series of numbers, keeping the last capacity
+    (timestamp, value) samples in two arrays of doubles (16 bytes per sample,
+    whatever the number of samples)."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._timestamps = array('d', [0.0]) * capacity
+        self._values = array('d', [0.0]) * capacity
+        self._start = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """Adds a sample, dropping the oldest one if the buffer is full."""
+        with self._lock:
+            index = (self._start + self._count) % self.capacity
+            self._timestamps[index] = timestamp
+            self._values[index] = value
+            if self._count < self.capacity:
+                self._count += 1
+            else:
+                self._start = (self._start + 1) % self.capacity
+
+    def export(self, since=None):
+        """Returns the (timestamps, values) arrays of the samples taken since
+        the since timestamp (all of them by default), oldest first."""
+        with self._lock:
+            end = self._start + self._count
+            if end <= self.capacity:
+                timestamps = self._timestamps[self._start:end]
+                values = self._values[self._start:end]
+            else:
+                end -= self.capacity
+                timestamps = self._timestamps[self._start:] + self._timestamps[:end]
+                values = self._values[self._start:] + self._values[:end]
+        if since is not None:
+            first = bisect_left(timestamps, since)
+            timestamps, values = timestamps[first:], values[first:]
+        return timestamps, values
+
+    def to_numpy(self, since=None):
+        """Same as export, returning numpy arrays (requires numpy)."""
+        if numpy is None:
+            raise ImportError("RingBuffer.to_numpy requires numpy: pip install numpy")
+        timestamps, values = self.export(since)
+        return numpy.frombuffer(timestamps, dtype=numpy.float64), numpy.frombuffer(values, dtype=numpy.float64)
+
+    def aggregate(self, window=None, now=None):
+        """Returns the count, min, max, mean and last value of the samples of
+        the last window seconds (all of them by default), as a dictionary.
+        The statistics are None when there is no sample."""
+        since = None
+        if window is not None:
+            since = (time.time() if now is None else now) - window
+        timestamps, values = self.export(since)
+        if not values:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None, 'last': None}
+        return {
+            'count': len(values),
+            'min': min(values),
+            'max': max(values),
+            'mean': sum(values) / len(values),
+            'last': values[-1],
+        }
+
+class Sampler(object):
+
+    """Polls variables of devices periodically into RingBuffers.
+
+    >>> sampler = Sampler(spark, [('lamp1', 'temperature'), ('lamp2', 'temperature')], interval=5)
+    >>> sampler.start()
+    >>> sampler.aggregate('lamp1', 'temperature', window=3600)
+    {'count': 720, 'min': 19.5, 'max': 23.0, 'mean': 21.2, 'last': 21.5}
+
+    pairs is a list of (device name, variable) pairs. Every interval seconds
+    the variables are read concurrently by at most max_workers threads with
+    the BACKGROUND priority, each round being shifted by a random jitter
+    (a fraction of interval) so that samplers do not poll in sync. A round
+    taking longer than interval delays the next one instead of piling up.
+
+    Each pair keeps its last capacity samples. The values must be numbers:
+    readings which fail or are not numbers are counted in errors and the
+    last exception is kept in last_errors.
+    """
+
+    def __init__(self, spark_cloud, pairs, interval=10.0, capacity=3600, jitter=0.1, max_workers=None):
+        self.spark_cloud = spark_cloud
+        self.pairs = [(getattr(device, 'name', device), variable) for device, variable in pairs]
+        self.interval = interval
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.buffers = dict((pair, RingBuffer(capacity)) for pair in self.pairs)
+        self.errors = dict((pair, 0) for pair in self.pairs)
+        self.last_errors = {}
+        self.rounds = 0
+        self._random = random.Random()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts polling in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops polling, waiting for the current round to end."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        next_round = time.time()
+        while not self._stopped.is_set():
+            delay = next_round + self._random.uniform(-self.jitter, self.jitter) * self.interval - time.time()
+            if delay > 0 and self._stopped.wait(delay):
+                return
+            try:
+                self.sample()
+            except Exception:
+                pass  # the devices could not be listed, try again next round
+            next_round = max(next_round + self.interval, time.time())
+
+    def sample(self):
+        """Reads every variable once and records the values."""
+        devices = self.spark_cloud.devices
+        max_workers = self.max_workers or self.spark_cloud.max_workers or DEFAULT_MAX_WORKERS
+
+        def read(pair):
+            value = float(devices[pair[0]].read_variable(pair[1]))
+            return time.time(), value
+
+        with priority(BACKGROUND):
+            results = _parallel_map(read, self.pairs, max_workers)
+        for pair, result, error in results:
+            if error is None:
+                self.buffers[pair].append(*result)
+                self.last_errors.pop(pair, None)
+            else:
+                self.errors[pair] += 1
+                self.last_errors[pair] = error
+        self.rounds += 1
+
+    def buffer(self, device, variable):
+        """Returns the RingBuffer of a (device name, variable) pair."""
+        return self.buffers[(getattr(device, 'name', device), variable)]
+
+    def aggregate(self, device, variable, window=None):
+        """Returns the aggregates of the samples of a variable over the last
+        window seconds, see RingBuffer.aggregate."""
+        return self.buffer(device, variable).aggregate(window)
+
+    def export(self, since=None):
+        """Returns a dictionary mapping each (device name, variable) pair to
+        the (timestamps, values) arrays of its samples taken since the since
+        timestamp."""
+        return dict((pair, buffer.export(since)) for pair, buffer in self.buffers.items())
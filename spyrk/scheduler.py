@@ -0,0 +1,220 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+from . import instrumentation
+
+# Priority classes, the lower the sooner.
+CONTROL = 0
+INTERACTIVE = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {CONTROL: 'control', INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+DEFAULT_PRIORITIES = {
+    instrumentation.LOGIN: CONTROL,
+    instrumentation.FUNCTION: CONTROL,
+    instrumentation.EVENTS: CONTROL,
+    instrumentation.DEVICES: INTERACTIVE,
+    instrumentation.DEVICE_INFO: INTERACTIVE,
+    instrumentation.VARIABLE: INTERACTIVE,
+    instrumentation.PUBLISH: INTERACTIVE,
+}
+
+_local = threading.local()
+
+def current_priority():
+    """Returns the priority class set by priority() for the current thread,
+    or None."""
+    return getattr(_local, 'priority', None)
+
+@contextmanager
+def priority(level):
+    """Context manager sending the requests of the current thread with the
+    given priority class, whatever their endpoint.
+
+    >>> with priority(BACKGROUND):
+    ...     spark.read_variables(['temperature'])
+    """
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+def propagate_priority(func):
+    """Returns func wrapped to run with the priority class of the calling
+    thread, for functions run by worker threads."""
+    level = current_priority()
+    if level is None:
+        return func
+
+    def call(*args, **kwargs):
+        with priority(level):
+            return func(*args, **kwargs)
+    return call
+
+class _Waiter(object):
+
+    __slots__ = ('priority', 'seq', 'since')
+
+    def __init__(self, priority, seq, since):
+        self.priority = priority
+        self.seq = seq
+        self.since = since
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class RequestScheduler(object):
+
+    """Limits the rate of the requests sent to the Spark Cloud, sending the
+    most urgent first.
+
+    >>> scheduler = RequestScheduler(rate=10, burst=20)
+    >>> spark = SparkCloud(ACCESS_TOKEN, scheduler=scheduler)
+
+    Requests take a token from a bucket holding at most burst tokens and
+    refilled with rate tokens per second, waiting when it is empty. Waiting
+    requests are served by priority class then in order of arrival: function
+    calls, logins and events subscriptions (CONTROL) go ahead of device
+    listings and variable reads (INTERACTIVE), which go ahead of the requests
+    sent within priority(BACKGROUND). priorities maps endpoints to their
+    priority class, to override the defaults.
+
+    Several SparkCloud objects given the same scheduler share its limit.
+    """
+
+    def __init__(self, rate=10.0, burst=None, priorities=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.priorities = dict(DEFAULT_PRIORITIES)
+        self.priorities.update(priorities or {})
+        self._tokens = self.burst
+        self._updated = instrumentation.clock()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._waits = {}
+
+    def priority_of(self, endpoint):
+        """Returns the priority class of a request to endpoint from the
+        current thread."""
+        level = current_priority()
+        if level is None:
+            level = self.priorities.get(endpoint, INTERACTIVE)
+        return level
+
+    def acquire(self, endpoint):
+        """Waits for the turn of a request to endpoint and returns the time
+        waited, in seconds."""
+        with self._cond:
+            ticket = self.enqueue(endpoint)
+            try:
+                while True:
+                    delay = self.try_acquire(ticket)
+                    if delay is None:
+                        return instrumentation.clock() - ticket.since
+                    self._cond.wait(delay)
+            except BaseException:
+                self.cancel(ticket)
+                raise
+
+    def enqueue(self, endpoint):
+        """Queues a request to endpoint and returns its ticket, to give to
+        try_acquire until it is its turn.
+
+        acquire blocks the calling thread; enqueue, try_acquire and cancel let
+        callers wait their own way, like an event loop:
+
+        >>> ticket = scheduler.enqueue('variable')
+        >>> while True:
+        ...     delay = scheduler.try_acquire(ticket)
+        ...     if delay is None:
+        ...         break
+        ...     await asyncio.sleep(delay)
+        """
+        with self._cond:
+            ticket = _Waiter(self.priority_of(endpoint), next(self._seq), instrumentation.clock())
+            heapq.heappush(self._waiters, ticket)
+            return ticket
+
+    def try_acquire(self, ticket):
+        """Returns None if it is the turn of the request of ticket, which can
+        be sent, or the seconds to wait before trying again. Never blocks."""
+        with self._cond:
+            now = instrumentation.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._waiters[0] is ticket and self._tokens >= 1:
+                self._tokens -= 1
+                heapq.heappop(self._waiters)
+                count, total, longest = self._waits.get(ticket.priority, (0, 0.0, 0.0))
+                wait = now - ticket.since
+                self._waits[ticket.priority] = (count + 1, total + wait, max(longest, wait))
+                self._cond.notify_all()
+                return None
+            return max((1 - self._tokens) / self.rate, 0.001)
+
+    def cancel(self, ticket):
+        """Gives up the turn of a request queued by enqueue."""
+        with self._cond:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def collect(self):
+        """Returns a snapshot of the scheduler metrics as a dictionary.
+
+        'queue_depth' maps priority class names to the requests waiting,
+        'wait_time' maps them to the count, sum and max of the times waited
+        by the requests served, in seconds, and 'tokens' is the number of
+        requests which can be sent right away.
+        """
+        with self._cond:
+            depth = dict((name, 0) for name in PRIORITY_NAMES.values())
+            for waiter in self._waiters:
+                name = PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+                depth[name] = depth.get(name, 0) + 1
+            waits = dict(
+                (PRIORITY_NAMES.get(level, str(level)), {'count': count, 'sum': total, 'max': longest})
+                for level, (count, total, longest) in self._waits.items()
+            )
+            tokens = min(self.burst, self._tokens + (instrumentation.clock() - self._updated) * self.rate)
+            return {'queue_depth': depth, 'wait_time': waits, 'tokens': tokens}
+
+    def prometheus_text(self, prefix='spyrk'):
+        """Returns the metrics in the Prometheus text exposition format."""
+        metrics = self.collect()
+        name = prefix + '_scheduler_queue_depth'
+        lines = [
+            '# HELP {} Requests waiting for their turn.'.format(name),
+            '# TYPE {} gauge'.format(name),
+        ]
+        for level, depth in sorted(metrics['queue_depth'].items()):
+            lines.append('{}{{priority="{}"}} {}'.format(name, level, depth))
+        name = prefix + '_scheduler_wait_seconds'
+        lines.append('# HELP {} Time waited by the requests before being sent.'.format(name))
+        lines.append('# TYPE {} summary'.format(name))
+        for level, wait in sorted(metrics['wait_time'].items()):
+            lines.append('{}_sum{{priority="{}"}} {}'.format(name, level, wait['sum']))
+            lines.append('{}_count{{priority="{}"}} {}'.format(name, level, wait['count']))
+        return '\n'.join(lines) + '\n'
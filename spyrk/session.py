@@ -0,0 +1,111 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class PooledSession(requests.Session):
+
+    """A requests session with a configurable pool of keep-alive connections.
+
+    >>> session = PooledSession(pool_maxsize=50, proxies={'https': PROXY})
+    >>> spark = SparkCloud(ACCESS_TOKEN, session=session)
+    >>> print session.pool_stats()
+
+    A process forked from the one which created the session (by
+    multiprocessing, or a pre-forking server like gunicorn --preload) opens
+    its own connections on its first request rather than sharing the
+    connections of its parent.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, proxies=None):
+        """Creates the session.
+
+        pool_connections is the number of hosts for which a pool of connections
+        is kept, pool_maxsize the maximum number of connections kept per host.
+        With pool_block set, a request waits for a free connection instead of
+        opening a connection that will not be kept.
+
+        keep_alive set to False closes the connection after each request.
+
+        proxies maps URL schemes to proxy URLs, like in requests.
+        """
+        super(PooledSession, self).__init__()
+        self._pool_args = {
+            'pool_connections': pool_connections,
+            'pool_maxsize': pool_maxsize,
+            'pool_block': pool_block,
+        }
+        self._mount_adapter()
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        if proxies:
+            self.proxies.update(proxies)
+
+    def _mount_adapter(self):
+        """Mounts a new adapter, with empty pools, owned by this process."""
+        adapter = HTTPAdapter(**self._pool_args)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self._pid = os.getpid()
+
+    def send(self, request, **kwargs):
+        if self._pid != os.getpid():
+            # forked: the pooled connections are those of the parent process,
+            # drop them without closing them (nor taking their locks)
+            self._mount_adapter()
+        return super(PooledSession, self).send(request, **kwargs)
+
+    def pool_stats(self):
+        """Returns statistics about the connections of the session.
+
+        The dictionary gives the number of host pools, of requests sent, of
+        connections opened, of requests which reused an open connection, the
+        reuse rate of connections, and the number of idle connections.
+        """
+        pools = []
+        for adapter in set(self.adapters.values()):
+            manager = adapter.poolmanager
+            pools.extend(manager.pools.get(key) for key in manager.pools.keys())
+        pools = [pool for pool in pools if pool is not None]
+
+        num_requests = sum(pool.num_requests for pool in pools)
+        num_connections = sum(pool.num_connections for pool in pools)
+        reused = max(num_requests - num_connections, 0)
+        return {
+            'pools': len(pools),
+            'requests': num_requests,
+            'connections': num_connections,
+            'reused': reused,
+            'reuse_rate': float(reused) / num_requests if num_requests else 0.0,
+            'idle': sum(
+                len([conn for conn in pool.pool.queue if conn is not None])
+                for pool in pools if pool.pool is not None
+            ),
+        }
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+def shared_session():
+    """Returns the PooledSession used by default by every SparkCloud."""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = PooledSession()
+        return _shared_session
@@ -13,12 +13,286 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import namedtuple
+import sys
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait  # pip install futures (Python 2)
 
 from hammock import Hammock  # pip install hammock
 from cached_property import timed_cached_property # pip install cached-property
 
-class SparkCloud(object):
+from .cache import SingleFlight
+from .catalog import CatalogSnapshot, SharedCatalog
+from .errors import error_from_reply, DeviceOfflineError
+from . import instrumentation
+from .events import EventStream, READ_TIMEOUT
+from .resilience import RetryPolicy, device_timeout_error
+from .scheduler import priority, propagate_priority, BACKGROUND
+from .session import shared_session
+from .streaming import iter_json_array
+from .timeouts import operation_timeout, split_timeout
+from .tokens import Token, FileTokenStore
+
+API_URL = 'https://api.particle.io'
+DEFAULT_MAX_WORKERS = 8
+MAX_DEVICE_CLASSES = 8  # Device classes kept per SparkCloud
+
+try:
+    from types import MappingProxyType as _frozen_dict
+except ImportError:  # Python 2
+    _frozen_dict = dict
+_sys_intern = getattr(sys, 'intern', None) or intern  # Python 2
+
+def _intern(value):
+    """Interns native strings, leaving other values as is: Python 2 cannot
+    intern the unicode strings json returns."""
+    return _sys_intern(value) if type(value) is str else value
+
+VariableResult = namedtuple('VariableResult', ['device', 'variable', 'value', 'error'])
+VariableResult.__doc__ = """Value of a variable read in a batch, error being the
+exception raised if the variable could not be read."""
+VariableResult.ok = property(lambda self: self.error is None)
+
+FunctionResult = namedtuple('FunctionResult', ['device', 'function', 'value', 'error'])
+FunctionResult.__doc__ = """Return value of a function called by a broadcast, error
+being the exception raised if the call failed."""
+FunctionResult.ok = property(lambda self: self.error is None)
+
+def _exposes_variable(device, variable):
+    """Tells if a device is known to expose a variable."""
+    try:
+        return bool(device.connected and device.variables and variable in device.variables)
+    except Exception:
+        # the details of the device cannot be fetched
+        return False
+
+def _exposes_function(device, function):
+    """Tells if a device is known to expose a function."""
+    try:
+        return bool(device.connected and device.functions and function in device.functions)
+    except Exception:
+        return False
+
+# Device fields added by the device details
+_DETAIL_KEYS = ('functions', 'variables', 'requires_deep_update', 'status')
+
+_CatalogEntry = namedtuple('_CatalogEntry', ['listing', 'info', 'device'])
+
+class _LazyDetails(object):
+
+    """Details of a device, fetched on first access of its functions,
+    variables or status.
+    
+    A failed fetch is not tried again: its exception is raised again until
+    the next refresh of the devices gives the device new details.
+    """
+    
+    __slots__ = ('spark_cloud', 'device_id', 'info', 'error')
+    
+    def __init__(self, spark_cloud, device_id):
+        self.spark_cloud = spark_cloud
+        self.device_id = device_id
+        self.info = None
+        self.error = None
+        
+    def get(self, name):
+        if self.info is None:
+            if self.error is not None:
+                raise self.error
+            try:
+                info = self.spark_cloud._get_device_info(self.device_id)
+            except Exception as e:
+                self.error = e
+                raise
+            self.info = self.spark_cloud._intern_info(info)
+        return self.info.get(name)
+        
+    def __repr__(self):
+        if self.error is not None:
+            return '<details not available: {}>'.format(self.error)
+        return '<details not fetched>' if self.info is None else '<details fetched>'
+
+class _DeviceCatalog(object):
+
+    """Keeps track of the devices of an account between two refreshes.
+    
+    Subclasses fetch the devices listing and details with whatever transport
+    they use, and provide _make_device_class and _device_api. The catalog
+    decides which devices need their details fetched again and builds the
+    dictionary of Device objects, reusing the unchanged ones.
+    """
+    
+    def _init_catalog(self):
+        self.device_errors = {}
+        self._catalog = {}
+        self._device_classes = OrderedDict()
+        self._interned = {}
+        
+    def _intern_info(self, info):
+        """Returns the details of a device reduced to the fields Device
+        objects use, the same object being shared by all the devices with the
+        same functions, variables and status (those running the same
+        firmware, usually).
+        
+        The functions are a tuple and the variables a read-only mapping, so
+        that a device cannot alter the details of the others.
+        """
+        if not isinstance(info, dict):
+            return info
+        functions = info.get('functions')
+        variables = info.get('variables')
+        try:
+            key = (
+                None if functions is None else tuple(functions),
+                None if variables is None else tuple(sorted(variables.items())),
+                info.get('status'),
+            )
+            shared = self._interned.get(key)
+        except (TypeError, AttributeError):
+            return info  # not the usual JSON types, keep as is
+        if shared is None:
+            shared = {
+                'functions': None if functions is None else tuple(_intern(f) for f in functions),
+                'variables': None if variables is None else _frozen_dict(dict(
+                    (_intern(name), _intern(kind))
+                    for name, kind in variables.items()
+                )),
+                'status': info.get('status'),
+            }
+            self._interned[key] = shared
+        return shared
+        
+    def _changed_device_ids(self, json_list):
+        """Returns the ids of the connected devices whose details have to be
+        fetched for this listing."""
+        return [
+            d['id'] for d in json_list or []
+            if d['connected'] and not self._is_unchanged(d)
+        ]
+        
+    def _build_devices(self, json_list, infos):
+        """Returns the dictionary of devices for a listing.
+        
+        infos maps the id of devices returned by _changed_device_ids to their
+        details, or to the exception raised while fetching them. The details
+        of the other changed devices are fetched on first access.
+        """
+        devices_dict = {}
+        device_errors = {}
+        catalog = {}
+        if json_list:
+            # it is possible the keys in json responses varies from one device to another: compute the set of all keys
+            allKeys = set(_DETAIL_KEYS)
+            for device_json in json_list:
+                allKeys.update(device_json.keys())
+
+            Device = self._make_device_class(allKeys)
+                    
+            for d in json_list:
+                devices_dict[d['name']] = self._build_device(d, infos, Device, allKeys, catalog, device_errors)
+                
+        self._catalog = catalog
+        self.device_errors = device_errors
+        return devices_dict
+        
+    def _build_device(self, d, infos, Device, allKeys, catalog, device_errors):
+        """Returns the Device object of a listing entry, adding its entry to
+        catalog and its error, if any, to device_errors."""
+        listing = dict(d)
+        previous = self._catalog.get(d['id'])
+        info = None
+        if d["connected"]:
+            if d['id'] in infos:
+                info = self._intern_info(infos[d['id']])
+            elif self._is_unchanged(d):
+                info = previous.info
+            else:
+                info = _LazyDetails(self, d['id'])
+            if isinstance(info, Exception):
+                device_errors[d['name']] = info
+                info = None
+                
+        if (previous is not None and previous.listing == listing and
+                previous.info is info and type(previous.device) is Device):
+            device = previous.device
+        else:
+            device = self._make_device(Device, d, info, allKeys)
+            
+        catalog[d['id']] = _CatalogEntry(listing, info, device)
+        return device
+        
+    @staticmethod
+    def _variable_pairs(devices_dict, variables, devices=None):
+        """Returns the (device, variable) pairs to read in a batch.
+        
+        devices is a list of device names or Device objects, every pair being
+        read. Without it, the connected devices of devices_dict exposing each
+        variable are read.
+        """
+        if devices is None:
+            return [
+                (device, variable)
+                for device in devices_dict.values() for variable in variables
+                if _exposes_variable(device, variable)
+            ]
+        devices = [d if isinstance(d, _BaseDevice) else devices_dict[d] for d in devices]
+        return [(device, variable) for device in devices for variable in variables]
+        
+    @staticmethod
+    def _select_devices(devices_dict, devices):
+        """Returns the Device objects chosen by devices: a list of device
+        names, ids or Device objects, or a predicate called with each Device.
+        """
+        if callable(devices):
+            return [device for device in devices_dict.values() if devices(device)]
+        by_id = None
+        selected = []
+        for d in devices:
+            if isinstance(d, _BaseDevice):
+                selected.append(d)
+            elif d in devices_dict:
+                selected.append(devices_dict[d])
+            else:
+                if by_id is None:
+                    by_id = dict((device.id, device) for device in devices_dict.values())
+                selected.append(by_id[d])
+        return selected
+        
+    @staticmethod
+    def _fingerprint(device_json):
+        """Returns the listing fields telling whether a device changed."""
+        return tuple(device_json.get(key) for key in ('id', 'last_heard', 'connected', 'last_app'))
+        
+    def _is_unchanged(self, device_json):
+        """Tells if the details of a device from the previous refresh are still
+        valid for this listing entry."""
+        previous = self._catalog.get(device_json['id'])
+        return (
+            previous is not None and previous.info is not None and
+            getattr(previous.info, 'error', None) is None and
+            self._fingerprint(previous.listing) == self._fingerprint(device_json)
+        )
+        
+    def _make_device(self, Device, device_json, info, allKeys):
+        """Builds a Device object out of a listing entry and device details."""
+        d = dict(device_json)
+        if d["connected"]:
+            if isinstance(info, _LazyDetails):
+                d['functions'] = d['variables'] = d['status'] = info
+            else:
+                if info is None:
+                    info = {}
+                d['functions'] = info.get('functions')
+                d['variables'] = info.get('variables')
+                d['status'] = info.get('status')
+            d['requires_deep_update'] = d.get('requires_deep_update', False)
+        # ensure the set of all keys is present in the dictionnary (Device constructor requires all keys present)
+        [d.setdefault(key, None) for key in allKeys]
+        
+        return Device(**d)
+        
+class SparkCloud(_DeviceCatalog):
 
     """Provides access to the Spark Cloud.
     
@@ -50,10 +324,13 @@ class SparkCloud(object):
     >>> spark.captain_hamster.myvariable
     """
     
-    def __init__(self, username_or_access_token, password=None, spark_api = Hammock('https://api.particle.io'), timeout=30):
+    def __init__(self, username_or_access_token, password=None, spark_api=None, timeout=30, max_workers=None, session=None, variable_cache=None, snapshot=None, token_store=None, eager=False, instruments=None, retry=None, circuit_breaker=None, timeouts=None, adaptive_timeout=None, scheduler=None, shared_catalog=None):
         """Initialise the connection to a Spark Cloud.
         
         If you give a user name and password an access token will be requested.
+        Give a TokenStore (or the path of a FileTokenStore) as token_store to
+        reuse the token while it is valid rather than requesting a new one each
+        time. The token is then renewed shortly before it expires.
         
         The list of known devices attached to your account will be requested.
         
@@ -61,83 +338,613 @@ class SparkCloud(object):
         take a long time to create the object. The Spark Cloud will take ~30
         seconds (per device?) to reply as it waits for an answer from the
         disconnected devices.
+        
+        The details (functions, variables and status) of a device are fetched
+        the first time they are accessed. Set eager to fetch the details of all
+        connected devices with the listing instead.
+        
+        Give max_workers to fetch the details of connected devices in parallel
+        with at most that many threads. In that mode a device whose details
+        cannot be fetched is still listed (without functions nor variables) and
+        the error is kept in the device_errors dictionary.
+        
+        The HTTP requests of the SparkCloud and its devices go through session,
+        a PooledSession keeping connections alive. By default all SparkCloud
+        objects share the same one.
+        
+        Give a VariableCache as variable_cache to cache the values of variables.
+        
+        instruments is a list of Instrument whose hooks are called around each
+        request, like a MetricsCollector.
+        
+        Give the path of a file (or a CatalogSnapshot) as snapshot to keep the
+        discovered devices on disk. If the file exists, the devices it holds
+        are available right away while a background thread refreshes them.
+        
+        Give the path of a file (or a SharedCatalog) as shared_catalog to
+        share the discovered devices between the processes of a host: a
+        single process at a time refreshes them from the Spark Cloud, the
+        others read them from the file.
+        
+        Give a RetryPolicy (or a number of retries) as retry to send again the
+        requests failing with transient errors, and a CircuitBreaker as
+        circuit_breaker to fail fast the requests to devices which keep timing
+        out. Errors returned by the Spark Cloud raise a SparkCloudError
+        subclass: DeviceTimeoutError, DeviceOfflineError, AuthenticationError.
+        
+        timeout is in seconds, or a (connect, read) pair. timeouts maps
+        operations (instrumentation.VARIABLE, FUNCTION, DEVICE_INFO, DEVICES,
+        LOGIN, EVENTS, PUBLISH) to their own timeout. Give an AdaptiveTimeout as
+        adaptive_timeout to shorten the timeouts of each device according to
+        its observed latency.
+        
+        Give a RequestScheduler as scheduler to limit the rate of the requests,
+        sending function calls ahead of variable reads and background
+        refreshes.
         """
+        if spark_api is None:
+            spark_api = Hammock(API_URL)
+            if session is None:
+                session = shared_session()
+        if session is not None:
+            spark_api._session = session
         self.spark_api = spark_api
+        self._root_api = spark_api
+        self.session = session
+        self.variable_cache = variable_cache
+        self._single_flight = SingleFlight()
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.eager = eager
+        self.instruments = list(instruments or [])
+        self.timeouts = dict(timeouts or {})
+        self.adaptive_timeout = adaptive_timeout
+        if adaptive_timeout is not None and adaptive_timeout not in self.instruments:
+            self.instruments.append(adaptive_timeout)
+        if retry is not None and not isinstance(retry, RetryPolicy):
+            retry = RetryPolicy(retries=retry)
+        self.retry = retry
+        self.circuit_breaker = circuit_breaker
+        self.scheduler = scheduler
+        self._init_catalog()
         
+        if token_store is not None and not hasattr(token_store, 'lock'):
+            token_store = FileTokenStore(token_store)
+        self.token_store = token_store
+        self._token_lock = threading.Lock()
+        self._credentials = None
         if password is None:
             self.access_token = username_or_access_token
         else:
-            self.access_token = self._login(username_or_access_token, password)
+            self._credentials = (username_or_access_token, password)
+            self._token = self._obtain_token(username_or_access_token, password)
             
         self.spark_api = self.spark_api.v1.devices
-        self.timeout = timeout
+        
+        if snapshot is not None and not isinstance(snapshot, CatalogSnapshot):
+            snapshot = CatalogSnapshot(snapshot)
+        self.snapshot = snapshot
+        if snapshot is not None:
+            self._load_snapshot()
+            
+        if shared_catalog is not None and not isinstance(shared_catalog, SharedCatalog):
+            shared_catalog = SharedCatalog(shared_catalog)
+        self.shared_catalog = shared_catalog
+        self._shared_devices = None
+            
+    def _load_snapshot(self):
+        """Makes the devices of the snapshot available and starts refreshing
+        them in the background."""
+        loaded = self.snapshot.load()
+        if loaded is None:
+            return
+        json_list, infos = loaded
+        if self.eager:
+            # connected devices without details in the snapshot are fetched by the next refresh
+            for device_id in self._changed_device_ids(json_list):
+                infos.setdefault(device_id, IOError("device details are not in the snapshot"))
+        self.devices = self._build_devices(json_list, infos)
+        
+        self._revalidation = threading.Thread(target=self._revalidate)
+        self._revalidation.daemon = True
+        self._revalidation.start()
+        
+    def _revalidate(self):
+        """Refreshes the devices, keeping the current ones on failure."""
+        try:
+            with priority(BACKGROUND):
+                self.devices = self._single_flight.do(('devices',), self._refresh_devices)
+        except Exception:
+            pass
 
+    def pool_stats(self):
+        """Returns the connection pool statistics of the session, or None if
+        the session is not a PooledSession."""
+        if hasattr(self.session, 'pool_stats'):
+            return self.session.pool_stats()
+        return None
+
+    def _request(self, endpoint, device_id, method, **kwargs):
+        """Sends a request with method, a Hammock HTTP method, and returns
+        the response, raising a SparkCloudError if the Spark Cloud returned an
+        error.
+        
+        endpoint and device_id tell the instruments what the request is for.
+        Transient errors are retried according to the retry policy, and the
+        requests to a device (but events streams) go through the circuit
+        breaker. A request to a device timing out raises DeviceTimeoutError.
+        """
+        breaker = None
+        if device_id is not None and endpoint != instrumentation.EVENTS:
+            breaker = self.circuit_breaker
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before_request(device_id)
+            try:
+                r = self._send(endpoint, device_id, method, **kwargs)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record(device_id, e)
+                delay = None if self.retry is None else self.retry.delay(attempt, e, endpoint)
+                if delay is None:
+                    timeout = device_timeout_error(e, endpoint, device_id)
+                    if timeout is not None:
+                        raise timeout
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            else:
+                if breaker is not None:
+                    breaker.record(device_id)
+                return r
+                
+    def _send(self, endpoint, device_id, method, **kwargs):
+        """Sends a request once, in its turn if there is a scheduler, calling
+        the instruments around it."""
+        if self.scheduler is not None:
+            self.scheduler.acquire(endpoint)
+        for instrument in self.instruments:
+            instrument.before_request(endpoint, device_id)
+        status = None
+        error = None
+        start = instrumentation.clock()
+        try:
+            r = method(**kwargs)
+            status = r.status_code
+            self._check_error(r, device_id)
+            return r
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = instrumentation.clock() - start
+            for instrument in self.instruments:
+                instrument.after_request(endpoint, device_id, status, duration, error)
+        
+    def _timeout(self, endpoint, device_id=None):
+        """Returns the timeout of a request."""
+        return operation_timeout(self.timeout, self.timeouts, self.adaptive_timeout, endpoint, device_id)
+        
     @staticmethod
-    def _check_error(response):
-        """Raises an exception if the Spark Cloud returned an error."""
+    def _check_error(response, device_id=None):
+        """Raises a SparkCloudError if the Spark Cloud returned an error."""
         if (not response.ok) or (response.status_code != 200):
-            raise Exception(
-                response.json()['error'] + ': ' +
-                response.json()['error_description']
-            )
+            try:
+                json = response.json()
+            except ValueError:
+                json = None
+            raise error_from_reply(response.status_code, json, device_id)
+        
+    @property
+    def access_token(self):
+        """The access token, renewed shortly before it expires when it was
+        obtained with a user name and password and a token store."""
+        if (self._credentials is not None and self.token_store is not None and
+                self._token.expires_within(self.token_store.refresh_margin)):
+            with self._token_lock:
+                if self._token.expires_within(self.token_store.refresh_margin):
+                    self._token = self._obtain_token(*self._credentials)
+        return self._token.access_token
+        
+    @access_token.setter
+    def access_token(self, access_token):
+        self._token = Token(access_token, None, None)
+        
+    def _obtain_token(self, username, password):
+        """Returns a valid Token, from the token store if possible."""
+        store = self.token_store
+        if store is None:
+            return self._login(username, password)
+        with store.lock(username):
+            token = store.get(username)
+            if token is None or token.expires_within(store.refresh_margin):
+                token = None if token is None else self._refresh_token(token)
+                if token is None:
+                    token = self._login(username, password)
+                store.put(username, token)
+            return token
         
     def _login(self, username, password):
-        """Proceed to login to the Spark Cloud and returns an access token."""
+        """Proceed to login to the Spark Cloud and returns a Token."""
         data = {
             'username': username,
             'password': password,
             'grant_type': 'password'
         }
-        r = self.spark_api.oauth.token.POST(auth=('spark', 'spark'), data=data, timeout=self.timeout)
-        self._check_error(r)
-        return r.json()['access_token']
+        return self._request_token(data)
+        
+    def _refresh_token(self, token):
+        """Returns a new Token using the refresh token of token, or None."""
+        if not token.refresh_token:
+            return None
+        data = {
+            'refresh_token': token.refresh_token,
+            'grant_type': 'refresh_token'
+        }
+        try:
+            return self._request_token(data)
+        except Exception:
+            return None
+        
+    def _request_token(self, data):
+        r = self._request(
+            instrumentation.LOGIN, None, self._root_api.oauth.token.POST,
+            auth=('spark', 'spark'), data=data, timeout=self._timeout(instrumentation.LOGIN)
+        )
+        return Token.from_json(r.json())
 
     @timed_cached_property(ttl=10) # cache the device for 10 seconds.
     def devices(self):
-        """Create a dictionary of devices known to the user account."""
+        """Create a dictionary of devices known to the user account.
+        
+        The refresh is incremental: the details of a device are only fetched
+        again when it is new or when its id, last_heard, connected or last_app
+        fields changed since the previous refresh. A Device object whose
+        listing did not change at all is reused as is.
+        
+        Threads asking for the devices while a refresh is in progress wait for
+        it instead of starting their own.
+        """
+        if self.shared_catalog is not None:
+            return self._single_flight.do(('devices',), self._refresh_shared_devices)
+        return self._single_flight.do(('devices',), self._refresh_devices)
+        
+    def _refresh_shared_devices(self):
+        """Returns the dictionary of devices of the shared catalog, refreshing
+        it first if it is stale and no other process is refreshing it."""
+        catalog = self.shared_catalog
+        if not catalog.is_fresh():
+            # without devices to return meanwhile, wait for the process refreshing them
+            with catalog.refresh_lock(blocking=not catalog.exists()) as leader:
+                if leader and not catalog.is_fresh():
+                    # a device failing is listed without details rather than failing every process
+                    devices_dict = self._refresh_devices(eager=True, max_workers=self.max_workers or DEFAULT_MAX_WORKERS)
+                    catalog.save(self._catalog_entries())
+                    catalog.mark_refreshed()
+                    self._shared_devices = devices_dict
+                    return devices_dict
+                    
+        if self._shared_devices is not None and not catalog.changed():
+            return self._shared_devices
+        loaded = catalog.load()
+        if loaded is None:
+            return self._refresh_devices()
+        self._shared_devices = self._build_devices(*loaded)
+        return self._shared_devices
+        
+    def _refresh_devices(self, eager=None, max_workers=None):
+        """Fetches the devices listing and returns the new dictionary of
+        devices, with the details of the changed devices if eager (by default
+        the eager attribute), fetched as by _get_devices_info."""
         params = {'access_token': self.access_token}
-        r = self.spark_api.GET(params=params, timeout=self.timeout)
-        self._check_error(r)
+        r = self._request(
+            instrumentation.DEVICES, None, self.spark_api.GET,
+            params=params, timeout=self._timeout(instrumentation.DEVICES)
+        )
         json_list = r.json()
 
-        devices_dict = {}
-        if json_list:
-            # it is possible the keys in json responses varies from one device to another: compute the set of all keys
-            allKeys = {'functions', 'variables', 'api', 'requires_deep_update', 'status'} # added by device_info
-            for device_json in json_list:
-                allKeys.update(device_json.keys())
-
-            Device = _BaseDevice.make_device_class(self, allKeys, timeout = self.timeout)
-                    
-            for d in json_list:
-                if d["connected"]:
-                    info = self._get_device_info(d['id'])
-                    d['functions'] = info.get('functions')
-                    d['variables'] = info.get('variables')
-                    d['api'] = self.spark_api(d['id'])
-                    d['requires_deep_update'] = d.get('requires_deep_update', False)
-                    d['status'] = info.get('status')
-                # ensure the set of all keys is present in the dictionnary (Device constructor requires all keys present)
-                [d.setdefault(key, None) for key in allKeys]
-
-                devices_dict[d['name']] = Device(**d)
-                
+        if eager is None:
+            eager = self.eager
+        infos = self._get_devices_info(self._changed_device_ids(json_list), max_workers) if eager else {}
+        devices_dict = self._build_devices(json_list, infos)
+        self._save_snapshot()
         return devices_dict
+        
+    def _save_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.save(self._catalog_entries())
+            
+    def _catalog_entries(self):
+        """Returns the (listing, info) pairs of the devices to save."""
+        return [
+            (entry.listing, entry.info.info if isinstance(entry.info, _LazyDetails) else entry.info)
+            for entry in self._catalog.values()
+        ]
+            
+    def iter_devices(self, chunk_size=65536):
+        """Yields the devices of the account as the listing is received.
+        
+        >>> for device in spark.iter_devices():
+        ...     print device.name
+        
+        The listing is parsed as it is downloaded rather than loaded at once,
+        so the first devices come sooner and the JSON of the whole listing is
+        never held in memory. The details of the devices are fetched on first
+        access, even if eager is set.
+        
+        Once the listing is complete, the devices dictionary is replaced with
+        the devices received. Fields appearing only in later entries of the
+        listing are added to all the devices of that dictionary, but not to
+        the Device objects already yielded.
+        """
+        params = {'access_token': self.access_token}
+        r = self._request(
+            instrumentation.DEVICES, None, self.spark_api.GET,
+            params=params, timeout=self._timeout(instrumentation.DEVICES), stream=True
+        )
+        allKeys = set(_DETAIL_KEYS)
+        Device = None
+        devices_dict = {}
+        device_errors = {}
+        catalog = {}
+        try:
+            for d in iter_json_array(r.iter_content(chunk_size)):
+                if Device is None or not allKeys.issuperset(d):
+                    allKeys.update(d)
+                    Device = self._make_device_class(allKeys)
+                device = self._build_device(d, {}, Device, allKeys, catalog, device_errors)
+                devices_dict[d['name']] = device
+                yield device
+        finally:
+            r.close()
+            
+        # give the devices built before a late field the same class as the others
+        for device_id, entry in catalog.items():
+            if type(entry.device) is not Device:
+                device = self._make_device(Device, entry.listing, entry.info, allKeys)
+                catalog[device_id] = entry._replace(device=device)
+                devices_dict[device.name] = device
+        self._catalog = catalog
+        self.device_errors = device_errors
+        self.devices = devices_dict
+        self._save_snapshot()
+        
+    def _make_device_class(self, entries):
+        """Returns the Device class for the given listing fields."""
+        return _BaseDevice.make_device_class(self, entries, timeout = self.timeout)
+        
+    def _device_api(self, device_id):
+        """Returns the API endpoint of a device."""
+        return self.spark_api(device_id)
             
     def _get_device_info(self, device_id):
         """Queries the Spark Cloud for detailed information about a device."""
+        return self._single_flight.do(('device', device_id), lambda: self._fetch_device_info(device_id))
+        
+    def _fetch_device_info(self, device_id):
         params = {'access_token': self.access_token}
-        r = self.spark_api(device_id).GET(params=params, timeout=30)
-        self._check_error(r)
+        r = self._request(
+            instrumentation.DEVICE_INFO, device_id, self.spark_api(device_id).GET,
+            params=params, timeout=self._timeout(instrumentation.DEVICE_INFO, device_id)
+        )
         return r.json()
+
+    def _get_devices_info(self, device_ids, max_workers=None):
+        """Queries the Spark Cloud for detailed information about several
+        devices.
+        
+        Returns a dictionary mapping each device id to its information. When
+        max_workers (by default the max_workers attribute) is set the queries
+        run in parallel and a device which failed maps to the exception
+        raised instead.
+        """
+        max_workers = max_workers or self.max_workers
+        if not max_workers:
+            return dict((device_id, self._get_device_info(device_id)) for device_id in device_ids)
+        return dict(
+            (device_id, result if error is None else error)
+            for device_id, result, error in _parallel_map(self._get_device_info, device_ids, max_workers)
+        )
+            
+    def read_variables(self, variables, devices=None, max_workers=None):
+        """Reads several variables of several devices concurrently.
+        
+        devices is a list of device names or Device objects. By default all
+        the connected devices exposing each variable are read.
+        
+        Returns a list of VariableResult, one per (device, variable) pair,
+        holding either the value or the error raised while reading it, so one
+        failing device does not prevent reading the others.
+        """
+        max_workers = max_workers or self.max_workers or DEFAULT_MAX_WORKERS
+        devices_dict = self.devices
+        if devices is None:
+            pairs = [
+                (device, variable)
+                for device, exposed in self._prefetch_details(devices_dict, 'variables', max_workers)
+                for variable in variables if exposed and variable in exposed
+            ]
+        else:
+            pairs = self._variable_pairs(devices_dict, variables, devices)
+        return [
+            VariableResult(device.name, variable, value, error)
+            for (device, variable), value, error in _parallel_map(
+                lambda pair: pair[0].read_variable(pair[1]), pairs, max_workers
+            )
+        ]
+            
+    def _prefetch_details(self, devices_dict, name, max_workers):
+        """Fetches concurrently the details of the connected devices not
+        fetched yet and returns the (device, functions or variables as name)
+        pairs of the devices whose details are available."""
+        return [
+            (device, value)
+            for device, value, error in _parallel_map(
+                lambda device: getattr(device, name),
+                [device for device in devices_dict.values() if device.connected],
+                max_workers
+            )
+            if error is None
+        ]
+        
+    def broadcast(self, function, args=(), devices=None, max_workers=None):
+        """Calls a function on several devices concurrently.
+        
+        >>> spark.broadcast('digitalwrite', ['D7', 'HIGH'], devices=lambda d: d.name.startswith('lamp'))
+        
+        args are the arguments (strings) given to the function. devices is a
+        list of device names, ids or Device objects, or a predicate called
+        with each Device. By default all the connected devices exposing the
+        function are called. At most max_workers calls run at the same time.
+        
+        Returns a list of FunctionResult in the order of the devices, holding
+        either the return value or the error raised by the call, so one
+        failing device does not prevent calling the others.
+        """
+        max_workers = max_workers or self.max_workers or DEFAULT_MAX_WORKERS
+        return [
+            FunctionResult(device.name, function, value, error)
+            for device, value, error in _parallel_map(
+                lambda device: device.call_function(function, *args),
+                self._broadcast_targets(function, devices, max_workers), max_workers
+            )
+        ]
+        
+    def broadcast_iter(self, function, args=(), devices=None, max_workers=None):
+        """Same as broadcast, but yields each FunctionResult as soon as its
+        call completes, to follow the progress over a large fleet.
+        
+        >>> for result in spark.broadcast_iter('reboot'):
+        ...     print result.device, 'done' if result.ok else result.error
+        
+        Calls not started yet are cancelled if the iteration stops early.
+        """
+        max_workers = max_workers or self.max_workers or DEFAULT_MAX_WORKERS
+        for device, value, error in _parallel_imap(
+            lambda device: device.call_function(function, *args),
+            self._broadcast_targets(function, devices, max_workers), max_workers
+        ):
+            yield FunctionResult(device.name, function, value, error)
+            
+    def _broadcast_targets(self, function, devices, max_workers):
+        """Returns the devices to call function on for a broadcast."""
+        devices_dict = self.devices
+        if devices is not None:
+            return self._select_devices(devices_dict, devices)
+        return [
+            device for device, functions in self._prefetch_details(devices_dict, 'functions', max_workers)
+            if functions and function in functions
+        ]
+            
+    def events(self, prefix=None, **kwargs):
+        """Subscribes to the events published by the devices of the account.
+        
+        Only the events whose name starts with prefix are received if given.
+        Returns an EventStream iterating over the events, the keyword
+        arguments being passed to EventStream.
+        """
+        return self._subscribe(self.spark_api.events, None, prefix, **kwargs)
+        
+    def publish(self, name, data=None, private=False, ttl=60):
+        """Publishes an event, waiting for the Spark Cloud to accept it.
+        
+        >>> spark.publish('door', 'open', private=True)
+        
+        ttl is the number of seconds the event data is relevant. To publish
+        without waiting for the network, see publisher.
+        """
+        params = {'access_token': self.access_token}
+        form = {'name': name, 'private': 'true' if private else 'false', 'ttl': str(ttl)}
+        if data is not None:
+            form['data'] = data
+        self._request(
+            instrumentation.PUBLISH, None, self.spark_api.events.POST,
+            params=params, data=form, timeout=self._timeout(instrumentation.PUBLISH)
+        )
+        
+    def publisher(self, **kwargs):
+        """Returns a started EventPublisher, sending the events published
+        through it in the background. The keyword arguments are passed to
+        EventPublisher.
+        
+        >>> publisher = spark.publisher(batch_size=100, flush_interval=1)
+        >>> publisher.publish('temperature', '21.5')
+        """
+        from .publisher import EventPublisher
+        return EventPublisher(self, **kwargs).start()
+        
+    def _subscribe(self, api, device_id, prefix=None, **kwargs):
+        """Returns an EventStream reading the events endpoint api."""
+        if prefix:
+            api = api(prefix)
+        params = {'access_token': self.access_token}
+        timeout = self.timeouts.get(instrumentation.EVENTS, (split_timeout(self.timeout)[0], READ_TIMEOUT))
+        
+        def connect(headers):
+            return self._request(
+                instrumentation.EVENTS, device_id, api.GET,
+                params=params, headers=headers, stream=True, timeout=timeout
+            )
+            
+        return EventStream(connect, **kwargs)
             
     def __getattr__(self, name):
         """Returns a Device object as an attribute of the SparkCloud object."""
+        if name.startswith('_'):
+            raise AttributeError(name)
         if name in self.devices:
             return self.devices[name]
         else:
             raise AttributeError()
     
+def _parallel_map(func, items, max_workers):
+    """Calls func on every item using a pool of at most max_workers threads.
+    
+    Returns a list of (item, result, exception) tuples in the order of items,
+    exception being None when the call succeeded. One failing call does not
+    prevent the others from completing.
+    """
+    items = list(items)
+    if not items:
+        return []
+    func = propagate_priority(func)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(lambda item: _capture(func, item), items))
+        
+def _parallel_imap(func, items, max_workers):
+    """Same as _parallel_map but yields the (item, result, exception) tuples
+    as the calls complete.
+    
+    Items are taken from the iterable as threads become available, with at
+    most 2 * max_workers calls queued. The queued calls are cancelled if the
+    generator is closed.
+    """
+    func = propagate_priority(func)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                pending.add(executor.submit(_capture, func, item))
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+                
+def _capture(func, item):
+    """Returns the (item, result, exception) tuple of calling func on item."""
+    try:
+        return item, func(item), None
+    except Exception as e:
+        return item, None, e
+        
 class _BaseDevice(object):
 
     """Parent class for the dynamic Device class.
@@ -152,8 +959,8 @@ class _BaseDevice(object):
     extending how a Device object should behave.
     """
 
-    @staticmethod
-    def make_device_class(spark_cloud, entries, timeout=30):
+    @classmethod
+    def make_device_class(cls, spark_cloud, entries, timeout=30):
         """Returns a dynamic Device class based on what a GET device list from
         the Spark Cloud returns.
         
@@ -161,43 +968,138 @@ class _BaseDevice(object):
         
         entries parameter should be the list of fields the Spark Cloud API is
         returning.
+        
+        The classes are memoized per spark_cloud: the same fields give the same
+        class, so that Device objects of successive refreshes share it. The
+        least recently used classes are forgotten beyond MAX_DEVICE_CLASSES.
         """
-        attrs = list(
-            set(
-                list(entries) + [
-                    'requires_deep_update', 'functions', 'variables', 'api', 'status'
-                ]
-            )
+        attrs = frozenset(
+            list(entries) + [
+                'requires_deep_update', 'functions', 'variables', 'status'
+            ]
         )
         
-        return type(
+        classes = getattr(spark_cloud, '_device_classes', None)
+        key = (cls, attrs, timeout)
+        if classes is not None and key in classes:
+            Device = classes.pop(key)
+            classes[key] = Device
+            return Device
+        
+        Device = type(
             'Device',
-            (_BaseDevice, namedtuple('Device', attrs)),
+            (cls, namedtuple('Device', list(attrs))),
             {'__slots__': (), 'spark_cloud': spark_cloud, 'timeout' : timeout}
         )
         
+        if classes is not None:
+            classes[key] = Device
+            while len(classes) > MAX_DEVICE_CLASSES:
+                classes.popitem(last=False)
+        return Device
+        
+    def _details(name):
+        def get(self):
+            value = getattr(super(_BaseDevice, self), name)
+            if isinstance(value, _LazyDetails):
+                return value.get(name)
+            return value
+        return property(get, doc="The {} of the device, fetched on first access.".format(name))
+        
+    functions = _details('functions')
+    variables = _details('variables')
+    status = _details('status')
+    del _details
+    
+    @property
+    def api(self):
+        """The API endpoint of the device, built on demand."""
+        return self.spark_cloud._device_api(self.id)
+        
+    def _check_available(self, name):
+        """Raises an IOError if the functions and variables of the device
+        cannot be reached."""
+        if not self.connected:
+            raise DeviceOfflineError(
+                "{}.{} is not available: the spark device is not connected.".format(self.name, name), device_id=self.id
+            )
+        if self.functions is None and self.variables is None:
+            raise IOError("{}.{} is not available: the spark device details could not be fetched.".format(self.name, name))
+        
     def __getattr__(self, name):
         """Returns virtual attributes corresponding to function or variable
         names.
         """
-        params = {'access_token': self.spark_cloud.access_token}
-        if not self.connected:
-            raise IOError("{}.{} is not available: the spark device is not connected.".format(self.name, name))
+        self._check_available(name)
 
         if name in self.functions:
         
             def fcall(*args):
-                data = {'params': ','.join(args)}
-                r = self.api(name).POST(params=params, data=data, timeout=self.timeout)
-                self.spark_cloud._check_error(r)
-                return r.json()['return_value']
+                return self._call_function(name, args)
                 
             return fcall
             
         elif name in self.variables:
-            r = self.api(name).GET(params=params, timeout=30)
-            self.spark_cloud._check_error(r)
-            return r.json()['result']
+            return self._read_variable(name)
             
         else:
             raise AttributeError()
+            
+    def call_function(self, name, *args):
+        """Calls a function of the device and returns its return value."""
+        self._check_available(name)
+        if name not in self.functions:
+            raise AttributeError("{} has no function {}".format(self.name, name))
+        return self._call_function(name, args)
+        
+    def _call_function(self, name, args):
+        params = {'access_token': self.spark_cloud.access_token}
+        data = {'params': ','.join(args)}
+        r = self.spark_cloud._request(
+            instrumentation.FUNCTION, self.id, self.api(name).POST,
+            params=params, data=data,
+            timeout=self.spark_cloud._timeout(instrumentation.FUNCTION, self.id)
+        )
+        return r.json()['return_value']
+        
+    def _read_variable(self, name):
+        cache = self.spark_cloud.variable_cache
+        if cache is not None:
+            return cache.get(self, name, lambda: self._coalesced_fetch_variable(name))
+        return self._coalesced_fetch_variable(name)
+        
+    def _coalesced_fetch_variable(self, name):
+        """Fetches a variable, sharing the request in progress for the same
+        variable if any."""
+        return self.spark_cloud._single_flight.do(
+            ('variable', self.id, name), lambda: self._fetch_variable(name)
+        )
+        
+    def _fetch_variable(self, name):
+        params = {'access_token': self.spark_cloud.access_token}
+        r = self.spark_cloud._request(
+            instrumentation.VARIABLE, self.id, self.api(name).GET,
+            params=params, timeout=self.spark_cloud._timeout(instrumentation.VARIABLE, self.id)
+        )
+        return r.json()['result']
+        
+    def read_variable(self, name):
+        """Returns the value of a variable of the device."""
+        self._check_available(name)
+        if name not in self.variables:
+            raise AttributeError("{} has no variable {}".format(self.name, name))
+        return self._read_variable(name)
+        
+    def read_variables(self, names, max_workers=None):
+        """Reads several variables of the device concurrently.
+        
+        Returns a list of VariableResult in the order of names.
+        """
+        return self.spark_cloud.read_variables(names, devices=[self], max_workers=max_workers)
+        
+    def events(self, prefix=None, **kwargs):
+        """Subscribes to the events published by the device.
+        
+        Same as SparkCloud.events.
+        """
+        return self.spark_cloud._subscribe(self.spark_cloud._device_api(self.id).events, self.id, prefix, **kwargs)
@@ -0,0 +1,81 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+def iter_json_array(chunks):
+    """Yields the items of a JSON array as they are parsed from chunks, an
+    iterable of bytes (or str) holding the JSON text.
+
+    >>> list(iter_json_array([b'[{"id": 1}, {"i', b'd": 2}]']))
+    [{'id': 1}, {'id': 2}]
+
+    Only the item being parsed and the unparsed end of the current chunk are
+    kept in memory. Raises ValueError if the text is not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    expected = '['  # what comes next: '[', an item, or ',' between items
+    chunks = iter(chunks)
+    exhausted = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == '[' or expected == ',':
+                if char == ']' and expected == ',':
+                    return
+                if char != expected:
+                    raise ValueError("Expected {!r} in a JSON array, got {!r}".format(
+                        expected, buffer[position:position + 20]
+                    ))
+                position += 1
+                expected = 'first item' if expected == '[' else 'item'
+                continue
+            if char == ']' and expected == 'first item':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # the item is complete once followed by a delimiter: a number may
+                # go on in the next chunk
+                if exhausted or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    yield item
+                    position = end
+                    expected = ','
+                    continue
+        if exhausted:
+            raise ValueError("Unexpected end of the JSON array")
+        # the item is incomplete: read the next chunk
+        buffer = buffer[position:]
+        position = 0
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            exhausted = True
+            buffer += utf8.decode(b'', True)
+            continue
+        buffer += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
@@ -0,0 +1,108 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import deque
+
+from . import instrumentation
+from .instrumentation import Instrument
+from .resilience import TIMEOUT_ERRORS
+
+def split_timeout(timeout):
+    """Returns the (connect, read) timeouts of a timeout given either as a
+    number of seconds or as a (connect, read) pair, like requests does."""
+    if isinstance(timeout, (tuple, list)):
+        return tuple(timeout)
+    return timeout, timeout
+
+def operation_timeout(default, timeouts, adaptive, endpoint, device_id=None):
+    """Returns the timeout of a request: the one of its endpoint in the
+    timeouts dictionary or default, shortened by adaptive (an
+    AdaptiveTimeout, or None) for requests to a device."""
+    timeout = timeouts.get(endpoint, default) if timeouts else default
+    if adaptive is not None and device_id is not None:
+        timeout = adaptive.timeout_for(endpoint, device_id, timeout)
+    return timeout
+
+class AdaptiveTimeout(Instrument):
+
+    """Derives the read timeout of the requests to each device from the
+    latencies observed for that device.
+
+    >>> spark = SparkCloud(ACCESS_TOKEN, adaptive_timeout=AdaptiveTimeout())
+
+    Once min_samples replies of a device were timed for an operation (reading
+    a variable, calling a function...), the read timeout of that operation
+    becomes multiplier times the given percentile of the last window
+    latencies, but no less than min_timeout nor more than the configured
+    timeout. A device answering in 300 ms then fails after about a second
+    instead of holding a worker for 30 seconds. The connect timeout is left
+    as configured.
+
+    Each request timing out on the client doubles the timeout of the
+    operation of the device, up to the configured one, until a reply comes:
+    a device which slows down gets a longer timeout, and its new latencies,
+    instead of failing every request. Requests timing out on the Spark Cloud
+    (408 errors) do not count.
+    """
+
+    def __init__(self, percentile=99, multiplier=3.0, min_timeout=1.0, window=50, min_samples=10):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._timeouts = {}  # consecutive client timeouts per (endpoint, device_id)
+        self._lock = threading.Lock()
+
+    def after_request(self, endpoint, device_id, status, duration, error):
+        if device_id is None or endpoint == instrumentation.EVENTS:
+            return
+        key = (endpoint, device_id)
+        if error is not None and (status is None or status == 408):
+            if status is None and isinstance(error, TIMEOUT_ERRORS):
+                with self._lock:
+                    self._timeouts[key] = self._timeouts.get(key, 0) + 1
+            return
+        with self._lock:
+            self._timeouts.pop(key, None)
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(duration)
+
+    def latency(self, endpoint, device_id):
+        """Returns the percentile of the latencies of an operation of a
+        device, or None if not enough replies were timed."""
+        with self._lock:
+            latencies = sorted(self._latencies.get((endpoint, device_id), ()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = int(round(self.percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[min(index, len(latencies) - 1)]
+
+    def timeout_for(self, endpoint, device_id, timeout):
+        """Returns the timeout of an operation of a device, timeout being the
+        configured one."""
+        latency = self.latency(endpoint, device_id)
+        if latency is None:
+            return timeout
+        connect, read = split_timeout(timeout)
+        adapted = max(self.min_timeout, latency * self.multiplier)
+        adapted *= 2 ** min(self._timeouts.get((endpoint, device_id), 0), 32)
+        if read is not None:
+            adapted = min(adapted, read)
+        return connect, adapted
@@ -0,0 +1,136 @@
+# This file is part of Spyrk.
+#
+# Spyrk is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Spyrk is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Spyrk.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .catalog import atomic_write_json
+
+class Token(namedtuple('Token', ['access_token', 'expires_at', 'refresh_token'])):
+
+    """An access token, expires_at being a timestamp or None if unknown."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, json):
+        """Makes a Token out of the reply of the Spark Cloud /oauth/token."""
+        expires_in = json.get('expires_in')
+        return cls(
+            json['access_token'],
+            time.time() + expires_in if expires_in else None,
+            json.get('refresh_token')
+        )
+
+    def expires_within(self, seconds):
+        """Tells if the token expires in less than seconds."""
+        return self.expires_at is not None and self.expires_at - time.time() < seconds
+
+class TokenStore(object):
+
+    """Keeps the access tokens obtained with a user name and password so that
+    they are reused instead of logging in again.
+
+    A token expiring in less than refresh_margin seconds is renewed. This
+    base class keeps the tokens in memory, FileTokenStore shares them between
+    processes.
+    """
+
+    def __init__(self, refresh_margin=3600):
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.RLock()
+
+    def get(self, username):
+        """Returns the Token of a user, or None."""
+        return self._tokens.get(username)
+
+    def put(self, username, token):
+        """Stores the Token of a user."""
+        self._tokens[username] = token
+
+    @contextmanager
+    def lock(self, username):
+        """Context manager ensuring a single login at a time for a user."""
+        with self._lock:
+            yield
+
+class FileTokenStore(TokenStore):
+
+    """A TokenStore keeping the tokens in a JSON file.
+
+    >>> spark = SparkCloud(USERNAME, PASSWORD, token_store=FileTokenStore('~/.spyrk/tokens.json'))
+
+    Processes sharing the file log in one at a time (using a lock file, on
+    POSIX systems) so that a worker starting while another one logs in reuses
+    the token it obtains. The file is only readable by its owner.
+    """
+
+    def __init__(self, path, refresh_margin=3600):
+        super(FileTokenStore, self).__init__(refresh_margin)
+        self.path = os.path.expanduser(path)
+        self._depth = 0
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def get(self, username):
+        entry = self._read().get(username)
+        if entry is None:
+            return None
+        return Token(entry['access_token'], entry.get('expires_at'), entry.get('refresh_token'))
+
+    def put(self, username, token):
+        with self.lock(username):
+            data = self._read()
+            data[username] = dict(token._asdict())
+            atomic_write_json(self.path, data)
+
+    @contextmanager
+    def lock(self, username):
+        with self._lock:
+            # the lock is reentrant: put() is called while logging in
+            if fcntl is None or self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            directory = os.path.dirname(self.path) or '.'
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,144 @@
+'''
+Fixtures shared by the tests: a MagicMock standing for Hammock and replying
+like the Spark Cloud for an account with two devices, and a local FakeCloud.
+'''
+import sys
+
+import pytest
+from mock import *
+from hammock import Hammock
+
+from spyrk import SparkCloud
+from spyrk.fake_cloud import FakeCloud
+
+# The asyncio client tests use async comprehensions and asyncio.run.
+collect_ignore = ['test_async_cloud.py'] if sys.version_info < (3, 7) else []
+
+# The fleet of the cloud fixture, unless parametrized with other FakeCloud
+# arguments:
+#     @pytest.mark.parametrize('cloud', [{'devices': 1}], indirect=True)
+DEFAULT_FLEET = {'devices': 5, 'offline': 1, 'offline_timeout': 0.2, 'disconnected': 1}
+
+def mockHTTPResponse(json_result):
+    mock = MagicMock()
+    mock.ok = True
+    mock.status_code = 200
+    mock.json = MagicMock(return_value=json_result)
+    return mock
+
+@pytest.fixture
+def hammock():
+    hammock = MagicMock()
+
+    # POST /oauth/token
+    token_response = mockHTTPResponse(
+        {
+            "access_token": "254406f79c1999af65a7df4388971354f85cfee9",
+            "token_type": "bearer",
+            "expires_in": 7776000
+        })
+    hammock.oauth.token.POST = MagicMock(return_value=token_response)
+
+    # GET v1/devices
+    device_list = mockHTTPResponse(
+        [
+            {
+                "id": "53ff6f0650723",
+                "name": "plumber_laser",
+                "last_app": None,
+                "last_heard": None,
+                "connected": False
+            },
+            {
+                "id": "53ff6e066667574845411267",
+                "name": "T1000",
+                "last_app": None,
+                "last_ip_address": "172.0.0.1",
+                "last_heard": "2015-06-02T20:56:28.532Z",
+                "product_id": 0,
+                "connected": True
+            }
+        ]
+    )
+
+    # GET /v1/devices/{DEVICE_ID}
+    device0_info = MagicMock()
+    device0_info.GET.return_value = mockHTTPResponse(
+        {
+            "id": "53ff6f0650723",
+            "name": "plumber_laser",
+            "connected": False,
+            "variables": {},
+            "functions": [],
+            "cc3000_patch_version": None,
+            "product_id": 0,
+            "last_heard": None
+        }
+    )
+
+    device1_info = MagicMock()
+    device1_info.GET.return_value = mockHTTPResponse(
+        {
+            "id": "53ff6e066667574845411267",
+            "name": "T1000",
+            "connected": True,
+            "variables": {
+                "game_state": "string"
+            },
+            "functions": [
+                "digitalread",
+                "digitalwrite",
+                "analogread",
+                "analogwrite"
+            ],
+            "cc3000_patch_version": "1.29",
+            "product_id": 0,
+            "last_heard": "2015-06-02T20:57:30.484Z"
+        }
+    )
+    def route_devices(*args):
+        if len(args) == 0:
+            return DEFAULT
+        if args[0] == "53ff6f0650723":
+            return device0_info
+        elif args[0] == "53ff6e066667574845411267":
+            return device1_info
+    hammock.v1.devices.side_effect = route_devices
+    hammock.v1.devices.GET.return_value = device_list
+
+    # POST /v1/devices/T1000/digitalwrite
+    hammock.v1.devices("53ff6e066667574845411267")("digitalwrite").POST.return_value = mockHTTPResponse(
+        {
+            "return_value": 1
+        }
+    )
+
+    # GET /v1/devices/T1000/game_state
+    hammock.v1.devices("53ff6e066667574845411267")("game_state").GET.return_value = mockHTTPResponse(
+        {
+            "cmd": "VarReturn",
+            "name": "game_state",
+            "result": "state",
+            "coreInfo": {
+                "last_app": "",
+                "last_heard": "2015-06-02T23:46:25.828Z",
+                "connected": True,
+                "last_handshake_at": "2015-06-02T23:45:56.201Z",
+                "deviceID": "53ff6e066667574845411267"
+            }
+        }
+    )
+
+    return hammock
+
+@pytest.fixture
+def cloud(request):
+    with FakeCloud(**getattr(request, 'param', DEFAULT_FLEET)) as cloud:
+        yield cloud
+
+@pytest.fixture
+def spark_for():
+    """Returns a function creating a SparkCloud talking to a FakeCloud."""
+    def spark_for(cloud, **kwargs):
+        return SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url), **kwargs)
+    return spark_for
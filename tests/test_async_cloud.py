@@ -0,0 +1,218 @@
+'''
+Testing AsyncSparkCloud against a fake aiohttp session.
+'''
+import asyncio
+import time
+
+import pytest
+
+from spyrk import MetricsCollector, SparkCloudError, RetryPolicy, FunctionResult, RequestScheduler
+from spyrk.async_cloud import AsyncSparkCloud
+
+DEVICE_LIST = [
+    {
+        "id": "53ff6f0650723",
+        "name": "plumber_laser",
+        "last_app": None,
+        "last_heard": None,
+        "connected": False
+    },
+    {
+        "id": "53ff6e066667574845411267",
+        "name": "T1000",
+        "last_app": None,
+        "last_ip_address": "172.0.0.1",
+        "last_heard": "2015-06-02T20:56:28.532Z",
+        "product_id": 0,
+        "connected": True
+    }
+]
+
+ROUTES = {
+    ('POST', '/oauth/token'): {"access_token": "254406f79c1999af65a7df4388971354f85cfee9"},
+    ('GET', '/v1/devices'): DEVICE_LIST,
+    ('GET', '/v1/devices/53ff6e066667574845411267'): {
+        "id": "53ff6e066667574845411267",
+        "name": "T1000",
+        "connected": True,
+        "variables": {"game_state": "string"},
+        "functions": ["digitalread", "digitalwrite", "analogread", "analogwrite"],
+    },
+    ('POST', '/v1/devices/53ff6e066667574845411267/digitalwrite'): {"return_value": 1},
+    ('GET', '/v1/devices/53ff6e066667574845411267/game_state'): {"result": "state"},
+}
+
+class FakeResponse(object):
+    def __init__(self, status, json):
+        self.status = status
+        self._json = json
+
+    async def json(self):
+        return self._json
+
+    @property
+    def content(self):
+        return self
+
+    async def iter_any(self):
+        for chunk in self._json:
+            yield chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+class FakeSession(object):
+    def __init__(self, routes=ROUTES):
+        self.routes = routes
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        path = url[len('https://api.particle.io'):]
+        self.requests.append((method, path, kwargs))
+        if (method, path) in self.routes:
+            return FakeResponse(200, self.routes[(method, path)])
+        return FakeResponse(404, {"error": "Not found", "error_description": path})
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_login():
+    session = FakeSession()
+    spark = run(AsyncSparkCloud.login("myLogin", "myPassword", session=session))
+    assert spark.access_token == "254406f79c1999af65a7df4388971354f85cfee9"
+    method, path, kwargs = session.requests[0]
+    assert kwargs['data'] == {"username": "myLogin", "password": "myPassword", "grant_type": "password"}
+
+def test_devices():
+    session = FakeSession()
+    spark = AsyncSparkCloud("myToken", session=session)
+    devices = run(spark.devices())
+    assert sorted(devices) == ["T1000", "plumber_laser"]
+    assert 'digitalwrite' in spark.T1000.functions
+    assert session.requests[0][2]['params'] == {"access_token": "myToken"}
+
+def test_devices_cached():
+    session = FakeSession()
+    spark = AsyncSparkCloud("myToken", session=session)
+    run(spark.devices())
+    run(spark.devices())
+    assert len(session.requests) == 2
+
+def test_attribute_before_devices():
+    spark = AsyncSparkCloud("myToken", session=FakeSession())
+    with pytest.raises(AttributeError):
+        spark.T1000
+
+def test_function_call_and_variable():
+    session = FakeSession()
+    spark = AsyncSparkCloud("myToken", session=session)
+
+    async def scenario():
+        await spark.devices()
+        return await spark.T1000.digitalwrite('D7', 'HIGH'), await spark.T1000.game_state
+
+    assert run(scenario()) == (1, "state")
+    method, path, kwargs = session.requests[-2]
+    assert (method, kwargs['data']) == ('POST', {"params": "D7,HIGH"})
+
+def test_many_concurrent_reads():
+    session = FakeSession()
+    spark = AsyncSparkCloud("myToken", session=session, max_concurrency=10)
+
+    async def scenario():
+        await spark.devices()
+        return await asyncio.gather(*[spark.T1000.game_state for _ in range(1000)])
+
+    assert run(scenario()) == ["state"] * 1000
+    # identical concurrent reads share one request
+    assert len(session.requests) == 3
+
+def test_error():
+    spark = AsyncSparkCloud("myToken", session=FakeSession(routes={}))
+    with pytest.raises(SparkCloudError) as e:
+        run(spark.devices())
+    assert 'Not found' in str(e.value)
+    assert e.value.status == 404
+
+def test_retry():
+    class FlakySession(FakeSession):
+        def request(self, method, url, **kwargs):
+            if len(self.requests) < 2:
+                self.requests.append((method, url[len('https://api.particle.io'):], kwargs))
+                return FakeResponse(503, {"error": "Service unavailable", "error_description": ""})
+            return super(FlakySession, self).request(method, url, **kwargs)
+
+    session = FlakySession()
+    spark = AsyncSparkCloud("myToken", session=session, retry=RetryPolicy(backoff=0.001))
+    assert sorted(run(spark.devices())) == ["T1000", "plumber_laser"]
+    assert [path for method, path, kwargs in session.requests] == ['/v1/devices'] * 3 + ['/v1/devices/53ff6e066667574845411267']
+
+def test_read_variables():
+    spark = AsyncSparkCloud("myToken", session=FakeSession())
+
+    async def scenario():
+        await spark.devices()
+        return await spark.read_variables(["game_state"]), await spark.T1000.read_variables(["missing"])
+
+    fleet, device = run(scenario())
+    assert [(r.device, r.value) for r in fleet] == [("T1000", "state")]
+    assert isinstance(device[0].error, AttributeError)
+
+def test_events():
+    chunks = [b'event: temperature\ndata: {"data": "21", "coreid": "53ff', b'6e066667574845411267"}\n\n']
+    routes = dict(ROUTES)
+    routes[('GET', '/v1/devices/events/temp')] = chunks
+    session = FakeSession(routes)
+    spark = AsyncSparkCloud("myToken", session=session)
+
+    async def scenario():
+        return [event async for event in spark.events("temp", reconnect=False)]
+
+    events = run(scenario())
+    assert [(event.name, event.data, event.coreid) for event in events] == [
+        ("temperature", "21", "53ff6e066667574845411267")
+    ]
+
+def test_instruments():
+    metrics = MetricsCollector()
+    spark = AsyncSparkCloud("myToken", session=FakeSession(), instruments=[metrics])
+
+    async def scenario():
+        await spark.devices()
+        await spark.T1000.game_state
+
+    run(scenario())
+    latency = metrics.collect()['latency']
+    assert sorted(latency) == ['device_info', 'devices', 'variable']
+    assert latency['variable']['count'] == 1
+
+def test_broadcast():
+    spark = AsyncSparkCloud("myToken", session=FakeSession())
+
+    async def scenario():
+        results = await spark.broadcast('digitalwrite', ['D7', 'HIGH'], devices=['plumber_laser', 'T1000'])
+        streamed = [result async for result in spark.broadcast_iter('digitalwrite', ['D7', 'HIGH'])]
+        return results, streamed
+
+    results, streamed = run(scenario())
+    assert isinstance(results[0].error, IOError)
+    assert results[1] == FunctionResult('T1000', 'digitalwrite', 1, None)
+    assert streamed == [FunctionResult('T1000', 'digitalwrite', 1, None)]
+
+def test_scheduler():
+    scheduler = RequestScheduler(rate=100, burst=1)
+    spark = AsyncSparkCloud("myToken", session=FakeSession(), scheduler=scheduler)
+
+    async def scenario():
+        await spark.devices()
+        return await asyncio.gather(*[spark.T1000.digitalwrite('D7', 'HIGH') for _ in range(5)])
+
+    start = time.time()
+    assert run(scenario()) == [1] * 5
+    assert time.time() - start > 0.05
+    waits = scheduler.collect()['wait_time']
+    assert waits['control']['count'] == 5
+    assert waits['interactive']['count'] == 2
@@ -0,0 +1,163 @@
+'''
+Testing the cache of variable values and the coalescing of requests.
+'''
+import threading
+import time
+from collections import namedtuple
+
+from mock import *
+
+from spyrk import SparkCloud, VariableCache
+from spyrk.cache import SingleFlight
+
+FakeDevice = namedtuple('FakeDevice', ['id', 'name'])
+device = FakeDevice("53ff6e066667574845411267", "T1000")
+other = FakeDevice("53ff6f0650723", "plumber_laser")
+
+def test_hit_and_miss():
+    cache = VariableCache(ttl=10)
+    fetch = MagicMock(return_value=21)
+    assert cache.get(device, "temp", fetch) == 21
+    assert cache.get(device, "temp", fetch) == 21
+    assert fetch.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_expiry():
+    cache = VariableCache(ttl=0.05)
+    fetch = MagicMock(side_effect=[1, 2])
+    assert cache.get(device, "temp", fetch) == 1
+    time.sleep(0.1)
+    assert cache.get(device, "temp", fetch) == 2
+
+def test_ttl_settings():
+    cache = VariableCache(ttl=10)
+    cache.set_ttl(0, variable="temp")
+    cache.set_ttl(5, device="T1000")
+    cache.set_ttl(1, device="T1000", variable="temp")
+    assert cache.ttl_for(device, "temp") == 1
+    assert cache.ttl_for(device, "humidity") == 5
+    assert cache.ttl_for(other, "temp") == 0
+    assert cache.ttl_for(other, "humidity") == 10
+
+def test_ttl_zero_disables_caching():
+    cache = VariableCache(ttl=0)
+    fetch = MagicMock(return_value=21)
+    cache.get(device, "temp", fetch)
+    cache.get(device, "temp", fetch)
+    assert fetch.call_count == 2
+    assert len(cache) == 0
+
+def test_lru_eviction():
+    cache = VariableCache(max_size=2)
+    cache.get(device, "a", lambda: 1)
+    cache.get(device, "b", lambda: 2)
+    cache.get(device, "a", lambda: 1)
+    cache.get(device, "c", lambda: 3)
+    assert cache.evictions == 1
+    fetch = MagicMock(return_value=2)
+    cache.get(device, "b", fetch)
+    assert fetch.call_count == 1
+
+def test_stale_while_revalidate():
+    cache = VariableCache(ttl=0.05, stale_while_revalidate=True)
+    cache.get(device, "temp", lambda: 1)
+    time.sleep(0.1)
+    assert cache.get(device, "temp", lambda: 2) == 1
+    assert cache.stale_hits == 1
+    for _ in range(100):
+        if not cache._refreshing:
+            break
+        time.sleep(0.01)
+    assert cache.get(device, "temp", lambda: 3) == 2
+
+def test_invalidate():
+    cache = VariableCache()
+    for d in (device, other):
+        for variable in ("a", "b"):
+            cache.get(d, variable, lambda: 1)
+    cache.invalidate(device="T1000", variable="a")
+    assert len(cache) == 3
+    cache.invalidate(device=other)
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+def test_spark_cloud_variable_cache(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, variable_cache=VariableCache())
+    assert spark.T1000.game_state == "state"
+    assert spark.T1000.game_state == "state"
+    assert hammock.v1.devices("53ff6e066667574845411267")("game_state").GET.call_count == 1
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 5
+    assert len(calls) == 1
+    assert flight.do("key", lambda: 43) == 43
+
+def test_single_flight_shares_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait()
+        raise IOError("timeout")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fetch)
+        except IOError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+
+def test_spark_cloud_concurrent_variable_reads(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    device = spark.T1000
+    get = hammock.v1.devices("53ff6e066667574845411267")("game_state").GET
+    response = get.return_value
+    release = threading.Event()
+
+    def slow_get(**kwargs):
+        release.wait()
+        return response
+
+    get.side_effect = slow_get
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(device.game_state)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["state"] * 5
+    assert get.call_count == 1
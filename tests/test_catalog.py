@@ -0,0 +1,62 @@
+'''
+Testing the on-disk snapshot of the devices catalog.
+'''
+import json
+import threading
+
+from spyrk import SparkCloud
+from spyrk.catalog import CatalogSnapshot
+
+def test_snapshot_written_on_refresh(hammock, tmpdir):
+    path = str(tmpdir.join("devices.json"))
+    spark = SparkCloud("myToken", spark_api=hammock, snapshot=path, eager=True)
+    spark.devices
+    with open(path) as f:
+        data = json.load(f)
+    entries = dict((entry['listing']['name'], entry) for entry in data['devices'])
+    assert entries['T1000']['info']['variables'] == {"game_state": "string"}
+    assert entries['plumber_laser']['info'] is None
+
+def test_snapshot_not_rewritten_when_unchanged(hammock, tmpdir):
+    path = tmpdir.join("devices.json")
+    spark = SparkCloud("myToken", spark_api=hammock, snapshot=str(path), eager=True)
+    spark.devices
+    path.write("garbage")
+    del spark.devices
+    spark.devices
+    assert path.read() == "garbage"
+
+def test_startup_from_snapshot(hammock, tmpdir):
+    path = str(tmpdir.join("devices.json"))
+    SparkCloud("myToken", spark_api=hammock, snapshot=path, eager=True).devices
+    hammock.v1.devices.GET.reset_mock()
+    hammock.v1.devices("53ff6e066667574845411267").GET.reset_mock()
+
+    response = hammock.v1.devices.GET.return_value
+    release = threading.Event()
+
+    def slow_listing(**kwargs):
+        release.wait()
+        return response
+
+    hammock.v1.devices.GET.side_effect = slow_listing
+    spark = SparkCloud("myToken", spark_api=hammock, snapshot=path, eager=True)
+    # available while the background refresh waits for the listing
+    assert 'digitalwrite' in spark.T1000.functions
+    assert spark.T1000.game_state == "state"
+    device = spark.T1000
+    release.set()
+    spark._revalidation.join()
+    assert hammock.v1.devices.GET.call_count == 1
+    # the background refresh found nothing new
+    assert spark.T1000 is device
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 0
+
+def test_invalid_snapshot_ignored(tmpdir):
+    path = tmpdir.join("devices.json")
+    path.write("{not json")
+    assert CatalogSnapshot(str(path)).load() is None
+    assert CatalogSnapshot(str(tmpdir.join("missing.json"))).load() is None
+    for data in ({"version": 1}, {"version": 1, "devices": [{"listing": {}}]}, {"version": 1, "devices": [1]}):
+        path.write(json.dumps(data))
+        assert CatalogSnapshot(str(path)).load() is None
@@ -0,0 +1,116 @@
+'''
+Testing the parsing and subscription of server-sent events streams.
+'''
+import json
+
+import pytest
+from mock import *
+
+from spyrk import SparkCloud, SparkCloudError, AuthenticationError
+from spyrk.events import SSEParser, ServerSentEvent, EventStream, Event
+
+def particle_event(name, data, coreid="53ff6e066667574845411267"):
+    payload = {"data": data, "ttl": "60", "published_at": "2015-06-02T20:56:28.532Z", "coreid": coreid}
+    return "event: {}\ndata: {}\n\n".format(name, json.dumps(payload)).encode('utf-8')
+
+def streaming_response(*chunks):
+    response = MagicMock()
+    response.ok = True
+    response.status_code = 200
+    response.iter_content.return_value = iter(chunks)
+    return response
+
+def test_parser_chunks_cut_anywhere():
+    stream = b":ok\n\nevent: temp\ndata: 21\n\nid: 7\ndata: a\ndata: b\r\n\r\n"
+    parser = SSEParser()
+    events = []
+    for i in range(len(stream)):
+        events.extend(parser.feed(stream[i:i + 1]))
+    assert events == [
+        ServerSentEvent("temp", "21", None),
+        ServerSentEvent("message", "a\nb", "7"),
+    ]
+    assert parser.last_event_id == "7"
+
+def test_parser_retry():
+    parser = SSEParser()
+    assert parser.feed(b"retry: 1500\n\n") == []
+    assert parser.retry == 1.5
+
+def test_stream_events():
+    stream = EventStream(lambda headers: streaming_response(particle_event("temp", "21")), reconnect=False)
+    events = list(stream)
+    assert events == [Event("temp", "21", "60", "2015-06-02T20:56:28.532Z", "53ff6e066667574845411267")]
+
+def test_stream_bounded_buffer():
+    chunks = [particle_event("temp", str(i)) for i in range(10)]
+    stream = EventStream(lambda headers: streaming_response(*chunks), buffer_size=3, reconnect=False)
+    stream._thread.join()
+    assert [event.data for event in stream] == ["7", "8", "9"]
+    assert stream.dropped == 7
+
+def test_stream_reconnects_and_resumes():
+    calls = []
+
+    def connect(headers):
+        calls.append(headers)
+        if len(calls) == 1:
+            return streaming_response(b"id: 1\n" + particle_event("temp", "1"))
+        if len(calls) == 2:
+            raise IOError("connection lost")
+        return streaming_response(particle_event("temp", "2"))
+
+    stream = EventStream(connect, retry_delay=0.01)
+    assert next(stream).data == "1"
+    assert next(stream).data == "2"
+    stream.close()
+    assert calls[0] == {}
+    assert calls[1] == {'Last-Event-ID': '1'}
+    assert stream.reconnections >= 2
+
+def test_stream_refused():
+    def connect(headers):
+        raise Exception("invalid_token: The access token provided is invalid.")
+
+    stream = EventStream(connect)
+    with pytest.raises(Exception) as e:
+        next(stream)
+    assert 'invalid_token' in str(e.value)
+
+def test_stream_reconnects_on_transient_errors():
+    calls = []
+
+    def connect(headers):
+        calls.append(headers)
+        if len(calls) == 1:
+            raise SparkCloudError("Service Unavailable", status=503)
+        if len(calls) == 2:
+            raise SparkCloudError("Too Many Requests", status=429)
+        return streaming_response(particle_event("temp", "1"))
+
+    stream = EventStream(connect, retry_delay=0.01)
+    assert next(stream).data == "1"
+    stream.close()
+    assert len(calls) >= 3
+
+def test_stream_ends_on_permission_error():
+    calls = []
+
+    def connect(headers):
+        calls.append(headers)
+        raise AuthenticationError("invalid_token", status=401)
+
+    stream = EventStream(connect, retry_delay=0.01)
+    with pytest.raises(AuthenticationError):
+        next(stream)
+    assert len(calls) == 1
+
+def test_spark_cloud_events():
+    hammock = MagicMock()
+    hammock.v1.devices.events("temp").GET.return_value = streaming_response(particle_event("temperature", "21"))
+    spark = SparkCloud("myToken", spark_api=hammock)
+    stream = spark.events("temp", reconnect=False)
+    assert [event.name for event in stream] == ["temperature"]
+    hammock.v1.devices.events("temp").GET.assert_called_once_with(
+        params={"access_token": "myToken"}, headers={}, stream=True, timeout=(30, 60)
+    )
@@ -0,0 +1,155 @@
+'''
+Testing SparkCloud over HTTP against the local fake Spark Cloud.
+'''
+import os
+import time
+
+import pytest
+from hammock import Hammock
+
+from spyrk import SparkCloud, SharedCatalog, DeviceTimeoutError
+
+def test_login(cloud):
+    spark = SparkCloud("myLogin", "myPassword", spark_api=Hammock(cloud.url))
+    assert spark.access_token == cloud.access_token
+
+def test_invalid_token(cloud):
+    spark = SparkCloud("badToken", spark_api=Hammock(cloud.url))
+    with pytest.raises(Exception) as e:
+        spark.devices
+    assert 'invalid_token' in str(e.value)
+
+def test_discovery(cloud, spark_for):
+    spark = spark_for(cloud)
+    assert len(spark.devices) == 5
+    assert cloud.requests == {'devices': 1}
+    assert spark.device0000.temperature == 21.5
+    assert spark.device0000.digitalwrite('D7', 'HIGH') == 1
+    assert spark.device0004.connected == False
+
+def test_offline_device(cloud, spark_for):
+    spark = spark_for(cloud, eager=True, max_workers=4)
+    spark.devices
+    assert sorted(spark.device_errors) == ['device0003']
+    assert 'Timed out.' in str(spark.device_errors['device0003'])
+    assert spark.device0000.variables == {'temperature': 'double', 'state': 'string'}
+
+@pytest.mark.parametrize('cloud', [{'devices': 20, 'error_rate': 0.5}], indirect=True)
+def test_error_injection(cloud, spark_for):
+    results = spark_for(cloud).read_variables(['state'], devices=['device{:04d}'.format(i) for i in range(20)])
+    errors = [result for result in results if not result.ok]
+    assert 0 < len(errors) < 20
+
+@pytest.mark.parametrize('cloud', [{'devices': 12, 'latency': lambda device_id: 0.3 if device_id.endswith('454') else 0.01}], indirect=True)
+def test_broadcast_progress(cloud, spark_for):
+    spark = spark_for(cloud)
+    results = list(spark.broadcast_iter('digitalwrite', ['D7', 'HIGH'], max_workers=4))
+    assert sorted(result.device for result in results) == ['device{:04d}'.format(i) for i in range(12)]
+    assert all(result.ok and result.value == 1 for result in results)
+    # the slow device does not hold back the others
+    assert results[-1].device == 'device0000'
+    assert cloud.requests['function'] == 12
+
+def test_compact_devices(cloud, spark_for):
+    spark = spark_for(cloud, eager=True, max_workers=4)
+    first, second = spark.device0000, spark.device0001
+    # devices running the same firmware share their details
+    assert first.functions is second.functions
+    assert first.variables is second.variables
+    with pytest.raises(TypeError):
+        first.variables['temperature'] = 'int'
+    # the API endpoint is not stored in each device
+    assert 'api' not in first._fields
+    assert first.api.GET(params={'access_token': cloud.access_token}).json()['name'] == 'device0000'
+
+def test_iter_devices(cloud, spark_for):
+    cloud.devices[-1]['platform_id'] = 6  # a field only in the last entry
+    spark = spark_for(cloud)
+    devices = spark.iter_devices(chunk_size=64)
+    first = next(devices)
+    assert first.name == 'device0000'
+    assert not hasattr(first, 'platform_id')
+    rest = list(devices)
+    assert [device.name for device in rest] == ['device{:04d}'.format(i) for i in range(1, 5)]
+    assert rest[-1].platform_id == 6
+    # the devices dictionary is updated with the complete schema
+    assert spark.device0000.platform_id is None
+    assert spark.device0004.platform_id == 6
+    assert spark.device0000.temperature == 21.5
+    assert cloud.requests['devices'] == 1
+
+def test_shared_catalog(cloud, tmpdir, spark_for):
+    path = str(tmpdir.join('devices.json'))
+    leader = spark_for(cloud, max_workers=4, shared_catalog=path)
+    assert len(leader.devices) == 5
+    assert cloud.requests == {'devices': 1, 'device_info': 4}
+    # another worker reads the devices and their details from the catalog
+    follower = spark_for(cloud, shared_catalog=path)
+    assert sorted(follower.devices) == sorted(leader.devices)
+    assert follower.device0000.variables == {'temperature': 'double', 'state': 'string'}
+    assert follower.device0000.temperature == 21.5
+    assert cloud.requests == {'devices': 1, 'device_info': 4, 'variable': 1}
+
+def test_shared_catalog_refresh(cloud, tmpdir, spark_for):
+    path = str(tmpdir.join('devices.json'))
+    catalog = SharedCatalog(path, ttl=60)
+    spark_for(cloud, max_workers=4, shared_catalog=catalog).devices
+    os.utime(catalog.lock_path, (0, 0))  # refreshed long ago
+    assert not catalog.is_fresh()
+
+    # while another worker refreshes the catalog the stale devices are used
+    cloud.devices[0]['name'] = 'renamed'
+    follower = spark_for(cloud, max_workers=4, shared_catalog=path)
+    with SharedCatalog(path).refresh_lock() as leader:
+        assert leader
+        assert 'device0000' in follower.devices
+    assert cloud.requests['devices'] == 1
+
+    # then the first worker finding it stale refreshes it
+    del follower.devices
+    assert 'renamed' in follower.devices
+    assert cloud.requests['devices'] == 2
+    assert catalog.is_fresh()
+
+@pytest.mark.parametrize('cloud', [{'devices': 20, 'offline': 2, 'offline_timeout': 0.5}], indirect=True)
+def test_read_variables_with_offline_devices(cloud, spark_for):
+    spark = spark_for(cloud, max_workers=16)
+    start = time.time()
+    results = spark.read_variables(['temperature', 'state'])
+    elapsed = time.time() - start
+    # the details of the offline devices are fetched once, concurrently
+    assert cloud.requests['device_info'] == 20
+    assert elapsed < 1.5
+    assert len(results) == 2 * 18 and all(result.ok for result in results)
+    # and not again until the next refresh
+    with pytest.raises(DeviceTimeoutError):
+        spark.device0018.variables
+    assert cloud.requests['device_info'] == 20
+
+@pytest.mark.parametrize('cloud', [{'devices': 20, 'offline': 2, 'offline_timeout': 0.5}], indirect=True)
+def test_broadcast_with_offline_devices(cloud, spark_for):
+    spark = spark_for(cloud, max_workers=16)
+    start = time.time()
+    results = spark.broadcast('digitalwrite', ['D7', 'HIGH'])
+    assert time.time() - start < 1.0
+    assert cloud.requests['device_info'] == 20
+    assert len(results) == 18 and all(result.ok for result in results)
+
+def test_shared_catalog_with_offline_device(cloud, tmpdir, spark_for):
+    path = str(tmpdir.join('devices.json'))
+    spark = spark_for(cloud, shared_catalog=path)
+    # without max_workers the offline device does not fail the refresh
+    assert len(spark.devices) == 5
+    assert sorted(spark.device_errors) == ['device0003']
+    follower = spark_for(cloud, shared_catalog=path)
+    assert follower.device0000.temperature == 21.5
+    assert cloud.requests['devices'] == 1
+
+@pytest.mark.parametrize('cloud', [{'devices': 1, 'latency': 0.3}], indirect=True)
+def test_client_hang_up_is_quiet(cloud, spark_for, capfd):
+    spark = spark_for(cloud, timeout=0.1)
+    spark.devices
+    with pytest.raises(DeviceTimeoutError):
+        spark.device0000.temperature
+    time.sleep(0.4)  # the server replies to the closed connection
+    assert 'Traceback' not in capfd.readouterr().err
@@ -0,0 +1,66 @@
+'''
+Testing the instrumentation hooks and the metrics collector.
+'''
+import pytest
+from mock import *
+
+from spyrk import SparkCloud, Instrument, MetricsCollector
+
+class Recorder(Instrument):
+    def __init__(self):
+        self.calls = []
+
+    def before_request(self, endpoint, device_id):
+        self.calls.append(('before', endpoint, device_id))
+
+    def after_request(self, endpoint, device_id, status, duration, error):
+        self.calls.append(('after', endpoint, device_id, status, error))
+
+def test_hooks(hammock):
+    recorder = Recorder()
+    spark = SparkCloud("myLogin", "myPassword", spark_api=hammock, instruments=[recorder])
+    spark.T1000.game_state
+    spark.T1000.digitalwrite('D7', 'HIGH')
+    device_id = "53ff6e066667574845411267"
+    assert recorder.calls == [
+        ('before', 'login', None), ('after', 'login', None, 200, None),
+        ('before', 'devices', None), ('after', 'devices', None, 200, None),
+        ('before', 'device_info', device_id), ('after', 'device_info', device_id, 200, None),
+        ('before', 'variable', device_id), ('after', 'variable', device_id, 200, None),
+        ('before', 'function', device_id), ('after', 'function', device_id, 200, None),
+    ]
+
+def test_hooks_on_error(hammock):
+    recorder = Recorder()
+    error = IOError("timeout")
+    hammock.v1.devices("53ff6e066667574845411267")("game_state").GET.side_effect = error
+    spark = SparkCloud("myToken", spark_api=hammock, instruments=[recorder])
+    device = spark.T1000
+    with pytest.raises(IOError):
+        device.game_state
+    assert recorder.calls[-1] == ('after', 'variable', "53ff6e066667574845411267", None, error)
+
+def test_metrics_collector():
+    metrics = MetricsCollector(buckets=(0.1, 1))
+    metrics.before_request('variable', 'a')
+    metrics.before_request('variable', 'b')
+    metrics.after_request('variable', 'a', 200, 0.05, None)
+    assert metrics.collect()['in_flight'] == {'variable': 1}
+    metrics.after_request('variable', 'b', 408, 5, Exception("timed out"))
+    metrics.before_request('function', 'a')
+    metrics.after_request('function', 'a', None, 0.5, IOError("connection reset"))
+    collected = metrics.collect()
+    assert collected['latency']['variable']['buckets'] == [(0.1, 1), (1, 1), (float('inf'), 2)]
+    assert collected['latency']['variable']['sum'] == 5.05
+    assert collected['errors'] == {('variable', '408'): 1, ('function', 'OSError'): 1}
+
+def test_prometheus_text():
+    metrics = MetricsCollector(buckets=(0.1,))
+    metrics.before_request('devices', None)
+    metrics.after_request('devices', None, 200, 0.05, None)
+    text = metrics.prometheus_text()
+    assert 'spyrk_request_duration_seconds_bucket{endpoint="devices",le="0.1"} 1' in text
+    assert 'spyrk_request_duration_seconds_bucket{endpoint="devices",le="+Inf"} 1' in text
+    assert 'spyrk_request_duration_seconds_count{endpoint="devices"} 1' in text
+    assert 'spyrk_requests_in_flight{endpoint="devices"} 0' in text
+    assert '# TYPE spyrk_request_errors_total counter' in text
@@ -0,0 +1,76 @@
+'''
+Testing publishing events, right away or in the background.
+'''
+import time
+
+import pytest
+
+from spyrk import EventPublisher, SparkCloudError, RequestScheduler
+
+def test_publish(cloud, spark_for):
+    spark_for(cloud).publish('door', 'open', private=True, ttl=30)
+    assert cloud.published == [{'name': 'door', 'data': 'open', 'private': 'true', 'ttl': '30'}]
+
+@pytest.mark.parametrize('cloud', [{'devices': 1, 'error_rate': 1}], indirect=True)
+def test_publish_error(cloud, spark_for):
+    with pytest.raises(SparkCloudError) as e:
+        spark_for(cloud).publish('door')
+    assert e.value.status == 500
+
+def test_flush_on_size(cloud, spark_for):
+    with spark_for(cloud).publisher(batch_size=10, flush_interval=60) as publisher:
+        for i in range(25):
+            assert publisher.publish('count', str(i))
+        deadline = time.time() + 5
+        while publisher.sent < 20 and time.time() < deadline:
+            time.sleep(0.01)
+        # two full batches are sent, the last 5 events wait for the interval
+        assert publisher.sent == 20
+        assert len(publisher) == 5
+        assert publisher.flush(timeout=5)
+        assert publisher.sent == 25
+    assert sorted(int(event['data']) for event in cloud.published) == list(range(25))
+
+def test_flush_on_interval(cloud, spark_for):
+    with spark_for(cloud).publisher(flush_interval=0.1) as publisher:
+        publisher.publish('ping')
+        time.sleep(0.05)
+        assert cloud.published == []
+        time.sleep(0.3)
+        assert [event['name'] for event in cloud.published] == ['ping']
+
+def test_publish_does_not_block(cloud, spark_for):
+    publisher = EventPublisher(spark_for(cloud), max_queue=3)
+    # not started: nothing is sent, the queue fills up
+    assert all(publisher.publish('e', str(i)) for i in range(3))
+    assert not publisher.publish('e', '3')
+    assert publisher.dropped == 1
+    publisher.start()
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert publisher.sent == 3
+    assert not publisher.publish('e', '4')
+
+@pytest.mark.parametrize('cloud', [{'devices': 1, 'error_rate': 1}], indirect=True)
+def test_delivery_failures(cloud, spark_for):
+    failures = []
+    with spark_for(cloud).publisher(on_error=lambda event, error: failures.append((event, error))) as publisher:
+        publisher.publish('door', 'open')
+        assert publisher.flush(timeout=5)
+    assert publisher.failed == 1 and publisher.sent == 0
+    event, error = failures[0]
+    assert (event.name, event.data) == ('door', 'open')
+    assert isinstance(error, SparkCloudError)
+
+def test_rate_limited(cloud, spark_for):
+    scheduler = RequestScheduler(rate=50, burst=1)
+    publisher = spark_for(cloud, scheduler=scheduler).publisher(batch_size=5)
+    start = time.time()
+    for i in range(10):
+        publisher.publish('e', str(i))
+    # the caller never waits for the network
+    assert time.time() - start < 0.05
+    assert publisher.flush(timeout=5)
+    assert time.time() - start > 0.15
+    publisher.close()
+    assert scheduler.collect()['wait_time']['interactive']['count'] == 10
@@ -0,0 +1,139 @@
+'''
+Testing the typed errors, the retry policy and the circuit breaker.
+'''
+import socket
+import time
+
+import pytest
+import requests
+from mock import *
+from hammock import Hammock
+
+from spyrk import (
+    SparkCloud, SparkCloudError, AuthenticationError, DeviceTimeoutError,
+    DeviceOfflineError, CircuitOpenError, RetryPolicy, CircuitBreaker,
+)
+from spyrk.errors import error_from_reply
+from spyrk.fake_cloud import FakeCloud
+
+DEVICE_ID = "53ff6e066667574845411267"
+
+def error_response(status, error, description):
+    response = MagicMock()
+    response.ok = False
+    response.status_code = status
+    response.json.return_value = {'error': error, 'error_description': description}
+    return response
+
+def test_error_from_reply():
+    error = error_from_reply(408, {'error': 'Timed out.', 'error_description': 'No answer'}, 'abc')
+    assert type(error) is DeviceTimeoutError
+    assert (error.status, error.device_id, str(error)) == (408, 'abc', 'Timed out.: No answer')
+    assert type(error_from_reply(401, {'error': 'invalid_token'})) is AuthenticationError
+    assert type(error_from_reply(400, {'error': 'Device is not connected'})) is DeviceOfflineError
+    assert type(error_from_reply(404, {'error': 'Variable not found'})) is SparkCloudError
+    assert str(error_from_reply(502, None)) == 'HTTP error 502'
+
+def test_typed_errors(hammock):
+    hammock.v1.devices(DEVICE_ID)("game_state").GET.return_value = error_response(408, 'Timed out.', 'No answer')
+    spark = SparkCloud("myToken", spark_api=hammock)
+    with pytest.raises(DeviceTimeoutError) as e:
+        spark.T1000.game_state
+    assert e.value.device_id == DEVICE_ID
+
+def test_retry_delays():
+    policy = RetryPolicy(retries=3, backoff=1, max_backoff=3, jitter=False)
+    unavailable = SparkCloudError('Service unavailable', status=503)
+    assert [policy.delay(attempt, unavailable, 'variable') for attempt in range(4)] == [1, 2, 3, None]
+    assert policy.delay(0, IOError(), 'devices') == 1
+    assert policy.delay(0, SparkCloudError('Variable not found', status=404), 'variable') is None
+    assert policy.delay(0, DeviceTimeoutError('Timed out.', status=408), 'variable') is None
+    assert policy.delay(0, unavailable, 'function') is None
+    assert policy.delay(0, unavailable, 'events') is None
+    assert RetryPolicy(retry_functions=True, jitter=False).delay(0, unavailable, 'function') == 0.5
+    assert policy.delay(0, IOError(), 'publish') is None
+    # requests to devices timing out on the client are not sent again
+    assert policy.delay(0, requests.exceptions.ReadTimeout(), 'variable') is None
+    assert policy.delay(0, socket.timeout(), 'device_info') is None
+    assert policy.delay(0, requests.exceptions.ReadTimeout(), 'devices') == 1
+    assert RetryPolicy(retry_publish=True, jitter=False).delay(0, unavailable, 'publish') == 0.5
+
+def test_retry_jitter():
+    policy = RetryPolicy(backoff=1, max_backoff=10)
+    delays = [policy.delay(2, IOError(), 'variable') for _ in range(50)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) > 1
+
+def test_retry(hammock):
+    variable = hammock.v1.devices(DEVICE_ID)("game_state").GET
+    variable.side_effect = [
+        error_response(503, 'Service unavailable', ''),
+        requests.exceptions.ConnectionError(),
+        variable.return_value,
+    ]
+    spark = SparkCloud("myToken", spark_api=hammock, retry=RetryPolicy(backoff=0.001))
+    assert spark.T1000.game_state == 'state'
+    assert variable.call_count == 3
+
+def test_retry_gives_up(hammock):
+    variable = hammock.v1.devices(DEVICE_ID)("game_state").GET
+    variable.side_effect = requests.exceptions.ConnectionError()
+    spark = SparkCloud("myToken", spark_api=hammock, retry=2)
+    spark.retry.backoff = 0.001
+    with pytest.raises(requests.exceptions.ConnectionError):
+        spark.T1000.game_state
+    assert variable.call_count == 3
+
+def test_circuit_breaker_states():
+    breaker = CircuitBreaker(failures=2, cooldown=0.05)
+    timeout = DeviceTimeoutError('Timed out.', status=408)
+    breaker.record('a', timeout)
+    breaker.before_request('a')
+    breaker.record('a', timeout)
+    assert breaker.state('a') == CircuitBreaker.OPEN
+    assert breaker.open_circuits() == ['a']
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('a')
+    breaker.before_request('b')
+
+    time.sleep(0.06)
+    assert breaker.state('a') == CircuitBreaker.HALF_OPEN
+    breaker.before_request('a')  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request('a')
+    breaker.record('a', requests.exceptions.ReadTimeout())
+    assert breaker.state('a') == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    breaker.before_request('a')
+    breaker.record('a', SparkCloudError('Variable not found', status=404))  # the device answered
+    assert breaker.state('a') == CircuitBreaker.CLOSED
+    breaker.before_request('a')
+
+def test_circuit_breaker_fails_fast():
+    with FakeCloud(devices=2, offline=1, offline_timeout=0.2) as cloud:
+        spark = SparkCloud(
+            cloud.access_token, spark_api=Hammock(cloud.url),
+            circuit_breaker=CircuitBreaker(failures=2, cooldown=60)
+        )
+        for _ in range(2):
+            with pytest.raises(DeviceTimeoutError):
+                spark.device0001.temperature
+            del spark.devices  # failed details are only fetched again by a refresh
+        start = time.time()
+        with pytest.raises(CircuitOpenError):
+            spark.device0001.temperature
+        assert time.time() - start < 0.1
+        assert cloud.requests['device_info'] == 2  # the details are fetched first
+        assert spark.device0000.temperature == 21.5
+
+def test_client_timeouts_are_not_retried():
+    with FakeCloud(devices=1) as cloud:
+        spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url), timeout=0.3, retry=RetryPolicy())
+        spark.device0000.variables
+        cloud.latency = 1
+        start = time.time()
+        with pytest.raises(DeviceTimeoutError):
+            spark.device0000.temperature
+        assert time.time() - start < 0.6
+        assert cloud.requests['variable'] == 1
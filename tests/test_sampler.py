@@ -0,0 +1,56 @@
+'''
+Testing the variable sampler and its ring buffers.
+'''
+import time
+from array import array
+
+from hammock import Hammock
+
+from spyrk import SparkCloud, Sampler, RingBuffer
+from spyrk.fake_cloud import FakeCloud
+
+def test_ring_buffer():
+    buffer = RingBuffer(4)
+    assert buffer.export() == (array('d'), array('d'))
+    for i in range(6):
+        buffer.append(100 + i, i * 10)
+    assert len(buffer) == 4
+    assert buffer.export() == (array('d', [102, 103, 104, 105]), array('d', [20, 30, 40, 50]))
+    assert buffer.export(since=104) == (array('d', [104, 105]), array('d', [40, 50]))
+
+def test_ring_buffer_aggregate():
+    buffer = RingBuffer(10)
+    assert buffer.aggregate()['count'] == 0
+    for i in range(5):
+        buffer.append(100 + i, i)
+    assert buffer.aggregate() == {'count': 5, 'min': 0, 'max': 4, 'mean': 2, 'last': 4}
+    assert buffer.aggregate(window=1.5, now=104) == {'count': 2, 'min': 3, 'max': 4, 'mean': 3.5, 'last': 4}
+
+def test_sample(hammock):
+    hammock.v1.devices("53ff6e066667574845411267")("game_state").GET.return_value.json.return_value["result"] = 12
+    spark = SparkCloud("myToken", spark_api=hammock)
+    sampler = Sampler(spark, [("T1000", "game_state"), ("T1000", "missing"), ("plumber_laser", "game_state")])
+    sampler.sample()
+    sampler.sample()
+    timestamps, values = sampler.export()[("T1000", "game_state")]
+    assert list(values) == [12, 12]
+    assert sampler.aggregate(spark.T1000, "game_state")['mean'] == 12
+    assert sampler.errors == {("T1000", "game_state"): 0, ("T1000", "missing"): 2, ("plumber_laser", "game_state"): 2}
+    assert isinstance(sampler.last_errors[("plumber_laser", "game_state")], IOError)
+    assert sampler.rounds == 2
+
+def test_periodic_sampling():
+    with FakeCloud(devices=3) as cloud:
+        spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url))
+        pairs = [('device{:04d}'.format(i), 'temperature') for i in range(3)]
+        with Sampler(spark, pairs, interval=0.05, jitter=0.2) as sampler:
+            time.sleep(0.3)
+    assert 3 <= sampler.rounds <= 8
+    for pair in pairs:
+        timestamps, values = sampler.buffer(*pair).export()
+        assert set(values) == {21.5}
+        assert list(timestamps) == sorted(timestamps)
+    # the sampler stopped
+    rounds = sampler.rounds
+    time.sleep(0.1)
+    assert sampler.rounds == rounds
@@ -0,0 +1,90 @@
+'''
+Testing the rate limiting and priority scheduling of requests.
+'''
+import threading
+import time
+
+from spyrk import SparkCloud, RequestScheduler, priority, BACKGROUND
+from spyrk.scheduler import current_priority, propagate_priority
+
+def test_rate_limit():
+    scheduler = RequestScheduler(rate=50, burst=5)
+    start = time.time()
+    for _ in range(15):
+        scheduler.acquire('variable')
+    # the 5 first requests are sent at once, the others at 50 per second
+    assert 0.18 < time.time() - start < 0.5
+
+def test_priority_order():
+    scheduler = RequestScheduler(rate=20, burst=1)
+    scheduler.acquire('variable')
+    order = []
+
+    def request(endpoint, level=None):
+        if level is None:
+            scheduler.acquire(endpoint)
+        else:
+            with priority(level):
+                scheduler.acquire(endpoint)
+        order.append((endpoint, level))
+
+    threads = [
+        threading.Thread(target=request, args=('variable', BACKGROUND)),
+        threading.Thread(target=request, args=('variable',)),
+        threading.Thread(target=request, args=('function',)),
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    assert order == [('function', None), ('variable', None), ('variable', BACKGROUND)]
+
+def test_try_acquire():
+    scheduler = RequestScheduler(rate=20, burst=1)
+    first = scheduler.enqueue('variable')
+    second = scheduler.enqueue('function')
+    # the function call goes first, then waits for the next token
+    assert scheduler.try_acquire(first) > 0
+    assert scheduler.try_acquire(second) is None
+    delay = scheduler.try_acquire(first)
+    assert 0 < delay <= 0.05
+    scheduler.cancel(first)
+    assert scheduler.collect()['queue_depth']['interactive'] == 0
+    time.sleep(delay)
+    assert scheduler.try_acquire(scheduler.enqueue('variable')) is None
+
+def test_priority_propagation():
+    assert current_priority() is None
+    with priority(BACKGROUND):
+        func = propagate_priority(current_priority)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    thread.join()
+    assert results == [BACKGROUND]
+    assert current_priority() is None
+
+def test_metrics():
+    scheduler = RequestScheduler(rate=100, burst=1)
+    scheduler.acquire('function')
+    scheduler.acquire('variable')
+    metrics = scheduler.collect()
+    assert metrics['queue_depth'] == {'control': 0, 'interactive': 0, 'background': 0}
+    assert metrics['wait_time']['control']['count'] == 1
+    assert metrics['wait_time']['interactive']['max'] > 0.005
+    text = scheduler.prometheus_text()
+    assert 'spyrk_scheduler_queue_depth{priority="background"} 0' in text
+    assert 'spyrk_scheduler_wait_seconds_count{priority="interactive"} 1' in text
+
+def test_spark_cloud_requests_are_scheduled(hammock):
+    scheduler = RequestScheduler(rate=1000)
+    spark = SparkCloud("myLogin", "myPassword", spark_api=hammock, scheduler=scheduler)
+    spark.T1000.game_state
+    spark.T1000.digitalwrite('D7', 'HIGH')
+    with priority(BACKGROUND):
+        spark.read_variables(['game_state'])
+    waits = scheduler.collect()['wait_time']
+    assert waits['control']['count'] == 2  # login and function call
+    assert waits['interactive']['count'] == 3  # devices, details and variable
+    assert waits['background']['count'] == 1  # read by a worker thread
@@ -0,0 +1,94 @@
+'''
+Testing the pooled HTTP session against a local keep-alive HTTP server.
+'''
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+from mock import patch
+
+from spyrk import SparkCloud
+from spyrk.session import PooledSession, shared_session
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'[]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def server_url():
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(server_url):
+    session = PooledSession()
+    for _ in range(3):
+        session.get(server_url + '/v1/devices').json()
+    stats = session.pool_stats()
+    assert stats['requests'] == 3
+    assert stats['connections'] == 1
+    assert stats['reused'] == 2
+    assert stats['idle'] == 1
+
+def test_connections_are_not_shared_after_fork(server_url):
+    session = PooledSession()
+    session.get(server_url + '/v1/devices').json()
+    adapter = session.get_adapter(server_url)
+    with patch('spyrk.session.os.getpid', return_value=-1):  # as in a forked child
+        session.get(server_url + '/v1/devices').json()
+        session.get(server_url + '/v1/devices').json()
+    assert session.get_adapter(server_url) is not adapter
+    stats = session.pool_stats()
+    assert stats['requests'] == 2
+    assert stats['connections'] == 1
+
+def test_no_keep_alive(server_url):
+    session = PooledSession(keep_alive=False)
+    r = session.get(server_url + '/v1/devices')
+    assert r.request.headers['Connection'] == 'close'
+
+def test_configuration():
+    session = PooledSession(pool_connections=3, pool_maxsize=20, proxies={'https': 'http://proxy:3128'})
+    adapter = session.get_adapter('https://api.particle.io')
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 20
+    assert session.proxies['https'] == 'http://proxy:3128'
+
+def test_spark_cloud_sessions():
+    assert SparkCloud("myToken").session is shared_session()
+    assert SparkCloud("myToken").spark_api._session is shared_session()
+
+    session = PooledSession()
+    spark = SparkCloud("myToken", session=session)
+    assert spark.spark_api("53ff6e066667574845411267")._session is session
+    assert spark.pool_stats()['requests'] == 0
+
+def test_spark_cloud_over_local_server(server_url):
+    session = PooledSession()
+    from hammock import Hammock
+    spark = SparkCloud("myToken", spark_api=Hammock(server_url), session=session)
+    assert spark.devices == {}
+    assert spark.pool_stats()['requests'] == 1
@@ -19,119 +19,7 @@ import pytest
 from mock import *
 from hammock import Hammock
 
-from spyrk import SparkCloud
-
-def mockHTTPResponse(json_result):
-    mock = MagicMock()
-    mock.ok = True
-    mock.status_code = 200
-    mock.json = MagicMock(return_value=json_result)
-    return mock
-
-@pytest.fixture
-def hammock():
-    hammock = MagicMock()
-
-    # POST /oauth/token
-    token_response = mockHTTPResponse(
-        {
-            "access_token": "254406f79c1999af65a7df4388971354f85cfee9",
-            "token_type": "bearer",
-            "expires_in": 7776000
-        })
-    hammock.oauth.token.POST = MagicMock(return_value=token_response)
-
-    # GET v1/devices
-    device_list = mockHTTPResponse(
-        [
-            {
-                "id": "53ff6f0650723",
-                "name": "plumber_laser",
-                "last_app": None,
-                "last_heard": None,
-                "connected": False
-            },
-            {
-                "id": "53ff6e066667574845411267",
-                "name": "T1000",
-                "last_app": None,
-                "last_ip_address": "172.0.0.1",
-                "last_heard": "2015-06-02T20:56:28.532Z",
-                "product_id": 0,
-                "connected": True
-            }
-        ]
-    )
-
-    # GET /v1/devices/{DEVICE_ID}
-    device0_info = MagicMock()
-    device0_info.GET.return_value = mockHTTPResponse(
-        {
-            "id": "53ff6f0650723",
-            "name": "plumber_laser",
-            "connected": False,
-            "variables": {},
-            "functions": [],
-            "cc3000_patch_version": None,
-            "product_id": 0,
-            "last_heard": None
-        }
-    )
-
-    device1_info = MagicMock()
-    device1_info.GET.return_value = mockHTTPResponse(
-        {
-            "id": "53ff6e066667574845411267",
-            "name": "T1000",
-            "connected": True,
-            "variables": {
-                "game_state": "string"
-            },
-            "functions": [
-                "digitalread",
-                "digitalwrite",
-                "analogread",
-                "analogwrite"
-            ],
-            "cc3000_patch_version": "1.29",
-            "product_id": 0,
-            "last_heard": "2015-06-02T20:57:30.484Z"
-        }
-    )
-    def route_devices(*args):
-        if len(args) == 0:
-            return DEFAULT
-        if args[0] == "53ff6f0650723":
-            return device0_info
-        elif args[0] == "53ff6e066667574845411267":
-            return device1_info
-    hammock.v1.devices.side_effect = route_devices
-    hammock.v1.devices.GET.return_value = device_list
-
-    # POST /v1/devices/T1000/digitalwrite
-    hammock.v1.devices("53ff6e066667574845411267")("digitalwrite").POST.return_value = mockHTTPResponse(
-        {
-            "return_value": 1
-        }
-    )
-
-    # GET /v1/devices/T1000/game_state
-    hammock.v1.devices("53ff6e066667574845411267")("game_state").GET.return_value = mockHTTPResponse(
-        {
-            "cmd": "VarReturn",
-            "name": "game_state",
-            "result": "state",
-            "coreInfo": {
-                "last_app": "",
-                "last_heard": "2015-06-02T23:46:25.828Z",
-                "connected": True,
-                "last_handshake_at": "2015-06-02T23:45:56.201Z",
-                "deviceID": "53ff6e066667574845411267"
-            }
-        }
-    )
-
-    return hammock
+from spyrk import SparkCloud, VariableResult, FunctionResult, DeviceOfflineError
 
 def test_login_password(hammock):
     """When login with user/password, SparkCloud fetches a token"""
@@ -165,11 +53,28 @@ def test_target_device_accessed_by_dictionnary(hammock):
         params={"access_token": "myToken"},
         timeout=30
     )
+    # the device details are only fetched when needed
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 0
+
+def test_lazy_device_details(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    device = spark.T1000
+    assert 'digitalwrite' in device.functions
+    assert 'game_state' in device.variables
+    assert device.status is None
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
+    del spark.devices
+    assert spark.T1000 is device
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
+
+def test_eager_device_details(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True)
+    spark.devices
     assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
 
 
 def test_target_devices_caching(hammock):
-    spark = SparkCloud("myToken", spark_api=hammock)
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True)
     assert spark.devices["T1000"].connected == True
     assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
     hammock.v1.devices("53ff6e066667574845411267").GET.reset_mock()
@@ -177,7 +82,9 @@ def test_target_devices_caching(hammock):
     assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 0
     time.sleep(10)
     assert spark.devices["T1000"].connected == True
-    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
+    assert hammock.v1.devices.GET.call_count == 2
+    # the device did not change: its details are not fetched again
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 0
 
 def test_function_list(hammock):
     spark = SparkCloud("myToken", spark_api=hammock)
@@ -206,3 +113,116 @@ def test_variable_fetch(hammock):
         params={"access_token": "myToken"},
         timeout=30
     )
+
+def test_parallel_device_info(hammock):
+    """With max_workers set, the devices are the same as a sequential fetch"""
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True, max_workers=4)
+    assert sorted(spark.devices) == ["T1000", "plumber_laser"]
+    assert 'digitalwrite' in spark.T1000.functions
+    assert spark.plumber_laser.connected == False
+    assert spark.device_errors == {}
+
+def test_disconnected_device(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    with pytest.raises(DeviceOfflineError) as e:
+        spark.plumber_laser.digitalwrite('D7', 'HIGH')
+    assert isinstance(e.value, IOError)  # as raised before
+    assert e.value.device_id == spark.plumber_laser.id
+
+def test_parallel_device_info_failure_is_isolated(hammock):
+    """A device whose details cannot be fetched does not break the listing"""
+    hammock.v1.devices("53ff6e066667574845411267").GET.side_effect = IOError("timeout")
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True, max_workers=4)
+    assert sorted(spark.devices) == ["T1000", "plumber_laser"]
+    assert spark.T1000.functions is None
+    assert isinstance(spark.device_errors["T1000"], IOError)
+    with pytest.raises(IOError):
+        spark.T1000.game_state
+
+def test_incremental_refresh_reuses_unchanged_devices(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True)
+    device = spark.T1000
+    del spark.devices
+    assert spark.T1000 is device
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 1
+
+def test_incremental_refresh_fetches_changed_devices(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, eager=True)
+    device = spark.T1000
+    device_list = hammock.v1.devices.GET.return_value.json.return_value
+    device_list[1]["last_heard"] = "2015-06-02T21:00:00.000Z"
+    del spark.devices
+    assert spark.T1000 is not device
+    assert spark.T1000.last_heard == "2015-06-02T21:00:00.000Z"
+    assert hammock.v1.devices("53ff6e066667574845411267").GET.call_count == 2
+
+def test_device_read_variables(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = spark.T1000.read_variables(["game_state", "missing"])
+    assert [(r.device, r.variable) for r in results] == [("T1000", "game_state"), ("T1000", "missing")]
+    assert results[0].ok and results[0].value == "state"
+    assert not results[1].ok and isinstance(results[1].error, AttributeError)
+
+def test_fleet_read_variables(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = spark.read_variables(["game_state"])
+    assert results == [VariableResult("T1000", "game_state", "state", None)]
+
+def test_fleet_read_variables_selection(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = spark.read_variables(["game_state"], devices=["plumber_laser", spark.T1000])
+    assert isinstance(results[0].error, IOError)
+    assert results[1].value == "state"
+
+def test_call_function(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    assert spark.T1000.call_function('digitalwrite', 'D7', 'HIGH') == 1
+    with pytest.raises(AttributeError):
+        spark.T1000.call_function('missing')
+
+def test_broadcast(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = spark.broadcast('digitalwrite', ['D7', 'HIGH'])
+    assert results == [FunctionResult("T1000", "digitalwrite", 1, None)]
+    hammock.v1.devices("53ff6e066667574845411267")("digitalwrite").POST.assert_called_once_with(
+        params={"access_token": "myToken"},
+        data={"params": "D7,HIGH"},
+        timeout=30
+    )
+
+def test_broadcast_selection(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = spark.broadcast('digitalwrite', ['D7', 'HIGH'], devices=["plumber_laser", "53ff6e066667574845411267"])
+    assert [r.device for r in results] == ["plumber_laser", "T1000"]
+    assert isinstance(results[0].error, IOError)
+    assert results[1].ok and results[1].value == 1
+    results = spark.broadcast('digitalwrite', ['D7', 'HIGH'], devices=lambda device: device.name == "T1000")
+    assert [r.device for r in results] == ["T1000"]
+    with pytest.raises(KeyError):
+        spark.broadcast('digitalwrite', devices=["unknown"])
+
+def test_broadcast_iter(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    results = list(spark.broadcast_iter('digitalwrite', ['D7', 'HIGH'], devices=[spark.T1000] * 10, max_workers=3))
+    assert results == [FunctionResult("T1000", "digitalwrite", 1, None)] * 10
+
+def test_device_class_memoized(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    Device = type(spark.T1000)
+    device_list = hammock.v1.devices.GET.return_value.json.return_value
+    device_list[1]["last_heard"] = "2015-06-02T21:00:00.000Z"
+    del spark.devices
+    assert type(spark.T1000) is Device
+    assert isinstance(spark.T1000, Device)
+
+def test_device_class_changes_with_schema(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock)
+    Device = type(spark.T1000)
+    device_list = hammock.v1.devices.GET.return_value.json.return_value
+    device_list[0]["platform_id"] = 6
+    del spark.devices
+    assert type(spark.T1000) is not Device
+    assert spark.plumber_laser.platform_id == 6
+    del device_list[0]["platform_id"]
+    del spark.devices
+    assert type(spark.T1000) is Device
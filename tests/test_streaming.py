@@ -0,0 +1,38 @@
+'''
+Testing the streaming parse of the devices listing.
+'''
+import json
+
+import pytest
+
+from spyrk.streaming import iter_json_array
+
+DATA = [
+    {"id": "53ff6f0650723", "name": "plümber", "connected": False, "last_heard": None},
+    {"id": "53ff6e066667574845411267", "name": "T1000", "product_id": 6, "connected": True},
+    12, -3.5e2, "text", None, True, [1, {"a": []}],
+]
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 5, 64, 4096])
+def test_iter_json_array(size):
+    text = json.dumps(DATA, indent=1).encode('utf-8')
+    assert list(iter_json_array(chunked(text, size))) == DATA
+
+def test_iter_json_array_is_incremental():
+    chunks = iter([b'[{"id": 1},', b' {"id": 2}', b']'])
+    items = iter_json_array(chunks)
+    assert next(items) == {"id": 1}
+    # the second chunk was not read yet
+    assert next(chunks) == b' {"id": 2}'
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array([b' [', b' ] '])) == []
+    assert list(iter_json_array(['[1', '2]'])) == [12]
+
+@pytest.mark.parametrize('chunks', [[b'{}'], [b'[1,'], [b'[{"a":'], [b''], [b'[1 2]'], [b'[1,]']])
+def test_iter_json_array_invalid(chunks):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunks))
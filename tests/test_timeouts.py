@@ -0,0 +1,101 @@
+'''
+Testing the per-operation and adaptive timeouts.
+'''
+import time
+
+import pytest
+import requests
+from mock import *
+from hammock import Hammock
+
+from spyrk import SparkCloud, AdaptiveTimeout, DeviceTimeoutError
+from spyrk.fake_cloud import FakeCloud
+from spyrk.timeouts import split_timeout
+
+DEVICE_ID = "53ff6e066667574845411267"
+
+def test_configured_timeout(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, timeout=5)
+    spark.T1000.game_state
+    hammock.v1.devices(DEVICE_ID).GET.assert_called_once_with(params={"access_token": "myToken"}, timeout=5)
+    hammock.v1.devices(DEVICE_ID)("game_state").GET.assert_called_once_with(params={"access_token": "myToken"}, timeout=5)
+
+def test_per_operation_timeouts(hammock):
+    spark = SparkCloud("myToken", spark_api=hammock, timeout=(2, 20), timeouts={'variable': (1, 3), 'function': 10})
+    spark.T1000.game_state
+    spark.T1000.digitalwrite('D7', 'HIGH')
+    hammock.v1.devices.GET.assert_called_once_with(params={"access_token": "myToken"}, timeout=(2, 20))
+    hammock.v1.devices(DEVICE_ID)("game_state").GET.assert_called_once_with(params={"access_token": "myToken"}, timeout=(1, 3))
+    assert hammock.v1.devices(DEVICE_ID)("digitalwrite").POST.call_args[1]['timeout'] == 10
+
+def test_split_timeout():
+    assert split_timeout(5) == (5, 5)
+    assert split_timeout((1, 3)) == (1, 3)
+
+def test_adaptive_timeout():
+    adaptive = AdaptiveTimeout(percentile=99, multiplier=2, min_timeout=0.5, min_samples=10)
+    for i in range(9):
+        adaptive.after_request('variable', 'a', 200, 0.3, None)
+    assert adaptive.timeout_for('variable', 'a', (3, 30)) == (3, 30)
+    adaptive.after_request('variable', 'a', 200, 0.4, None)
+    # timed out requests are not timed, a client timeout backs off
+    adaptive.after_request('variable', 'a', None, 30, requests.exceptions.ReadTimeout())
+    adaptive.after_request('variable', 'a', 408, 30, Exception("Timed out."))
+    assert adaptive.latency('variable', 'a') == 0.4
+    assert adaptive.timeout_for('variable', 'a', (3, 30)) == (3, 1.6)
+    adaptive.after_request('variable', 'a', 200, 0.4, None)
+    assert adaptive.timeout_for('variable', 'a', (3, 30)) == (3, 0.8)
+    assert adaptive.timeout_for('variable', 'a', 30) == (30, 0.8)
+    assert adaptive.timeout_for('variable', 'a', 0.6) == (0.6, 0.6)
+    assert adaptive.timeout_for('function', 'a', 30) == 30
+    assert adaptive.timeout_for('variable', 'b', 30) == 30
+
+def test_adaptive_timeout_min():
+    adaptive = AdaptiveTimeout(min_timeout=1, min_samples=1)
+    adaptive.after_request('variable', 'a', 200, 0.01, None)
+    assert adaptive.timeout_for('variable', 'a', 30) == (30, 1)
+
+def test_adaptive_timeout_over_http():
+    with FakeCloud(devices=1, latency=0.01) as cloud:
+        adaptive = AdaptiveTimeout(min_timeout=0.2, min_samples=5)
+        spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url), adaptive_timeout=adaptive)
+        assert adaptive in spark.instruments
+        for _ in range(5):
+            spark.device0000.temperature
+        cloud.latency = 2
+        start = time.time()
+        with pytest.raises(DeviceTimeoutError) as e:
+            spark.device0000.temperature
+        assert e.value.status is None and e.value.device_id == spark.device0000.id
+        assert isinstance(e.value.__cause__, requests.exceptions.Timeout)
+        assert time.time() - start < 1
+
+def test_adaptive_timeout_backs_off():
+    adaptive = AdaptiveTimeout(multiplier=2, min_timeout=0.5, min_samples=1)
+    adaptive.after_request('variable', 'a', 200, 0.1, None)
+    assert adaptive.timeout_for('variable', 'a', 5) == (5, 0.5)
+    adaptive.after_request('variable', 'a', None, 0.5, requests.exceptions.ReadTimeout())
+    assert adaptive.timeout_for('variable', 'a', 5) == (5, 1)
+    adaptive.after_request('variable', 'a', None, 1, requests.exceptions.ReadTimeout())
+    adaptive.after_request('variable', 'a', None, 2, requests.exceptions.ReadTimeout())
+    adaptive.after_request('variable', 'a', None, 4, requests.exceptions.ReadTimeout())
+    assert adaptive.timeout_for('variable', 'a', 5) == (5, 5)
+    # a reply ends the back off
+    adaptive.after_request('variable', 'a', 200, 0.2, None)
+    assert adaptive.timeout_for('variable', 'a', 5) == (5, 0.5)
+
+def test_adaptive_timeout_recovers_over_http():
+    with FakeCloud(devices=1, latency=0.01) as cloud:
+        adaptive = AdaptiveTimeout(min_timeout=0.2, min_samples=5)
+        spark = SparkCloud(cloud.access_token, spark_api=Hammock(cloud.url), timeout=5, adaptive_timeout=adaptive)
+        for _ in range(5):
+            spark.device0000.temperature
+        cloud.latency = 0.4  # the device slows down
+        failures = 0
+        for _ in range(10):
+            try:
+                spark.device0000.temperature
+            except DeviceTimeoutError:
+                failures += 1
+        assert failures <= 2
+        assert spark.device0000.temperature == 21.5
@@ -0,0 +1,61 @@
+'''
+Testing the reuse of access tokens through token stores.
+'''
+import json
+import time
+
+from mock import *
+
+from spyrk import SparkCloud
+from spyrk.tokens import Token, TokenStore, FileTokenStore
+
+def token_response(access_token, expires_in=7776000, refresh_token=None):
+    response = MagicMock()
+    response.ok = True
+    response.status_code = 200
+    response.json.return_value = {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": expires_in,
+        "refresh_token": refresh_token,
+    }
+    return response
+
+def test_token_reused_from_file(hammock, tmpdir):
+    path = str(tmpdir.join("tokens.json"))
+    first = SparkCloud("myLogin", "myPassword", spark_api=hammock, token_store=path)
+    second = SparkCloud("myLogin", "myPassword", spark_api=hammock, token_store=FileTokenStore(path))
+    assert hammock.oauth.token.POST.call_count == 1
+    assert first.access_token == second.access_token == "254406f79c1999af65a7df4388971354f85cfee9"
+    with open(path) as f:
+        assert json.load(f)["myLogin"]["access_token"] == "254406f79c1999af65a7df4388971354f85cfee9"
+
+def test_expiring_token_refreshed(hammock):
+    store = TokenStore(refresh_margin=60)
+    store.put("myLogin", Token("oldToken", time.time() + 10, "myRefreshToken"))
+    hammock.oauth.token.POST.return_value = token_response("newToken")
+    spark = SparkCloud("myLogin", "myPassword", spark_api=hammock, token_store=store)
+    assert spark.access_token == "newToken"
+    hammock.oauth.token.POST.assert_called_once_with(
+        auth=('spark', 'spark'),
+        data={"refresh_token": "myRefreshToken", "grant_type": "refresh_token"},
+        timeout=30
+    )
+    assert store.get("myLogin").access_token == "newToken"
+
+def test_token_renewed_before_expiry(hammock):
+    store = TokenStore(refresh_margin=60)
+    hammock.oauth.token.POST.return_value = token_response("shortToken", expires_in=120)
+    spark = SparkCloud("myLogin", "myPassword", spark_api=hammock, token_store=store)
+    assert spark.access_token == "shortToken"
+    hammock.oauth.token.POST.return_value = token_response("newToken")
+    store.put("myLogin", Token("shortToken", time.time() + 30, None))
+    spark._token = store.get("myLogin")
+    assert spark.access_token == "newToken"
+    assert hammock.oauth.token.POST.call_args[1]['data']['grant_type'] == 'password'
+
+def test_file_store_lock_is_reentrant(tmpdir):
+    store = FileTokenStore(str(tmpdir.join("tokens.json")))
+    with store.lock("myLogin"):
+        store.put("myLogin", Token("myToken", None, None))
+    assert store.get("myLogin") == Token("myToken", None, None)